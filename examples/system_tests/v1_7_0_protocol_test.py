@@ -225,5 +225,43 @@ class ProtocolTest(unittest.TestCase):
             self.assertEqual(len(resp_next_3["value"]["items"]), 0)
             self.assertTrue(resp_next_3["meta"]["done"])
 
+    def test_non_finite_floats(self):
+        # JSON has no NaN/Infinity (orjson writes null), so they come back as handles
+        req_create = {
+            "cmd": "debug_eval",
+            "session_id": self.session_id,
+            "req_id": "f-1",
+            "code": "[1e999, 1.5, 1e999 - 1e999]"
+        }
+        h_id = self.send_request(req_create)["value"]["id"]
+
+        resp_inf = self.send_request({
+            "cmd": "get_item",
+            "session_id": self.session_id,
+            "req_id": "f-2",
+            "target": h_id,
+            "key": {"kind": "value", "value": 0}
+        })
+        self.assertEqual(resp_inf["value"]["kind"], "handle")
+        self.assertEqual(resp_inf["value"]["repr"], "inf")
+
+        iter_id = self.send_request({
+            "cmd": "iter",
+            "session_id": self.session_id,
+            "req_id": "f-3",
+            "target": h_id
+        })["value"]["id"]
+        resp_batch = self.send_request({
+            "cmd": "iter_next_batch",
+            "session_id": self.session_id,
+            "req_id": "f-4",
+            "target": iter_id,
+            "batch_size": 10
+        })
+        items = resp_batch["value"]["items"]
+        self.assertEqual([x["kind"] for x in items], ["handle", "value", "handle"])
+        self.assertEqual(items[1]["value"], 1.5)
+        self.assertEqual(items[2]["repr"], "nan")
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,47 +1,128 @@
 import sys
 import json
-import uuid
+import itertools
 import traceback
+import os
+import struct
 import math
+import functools
+import types
+
+try:
+    import orjson  # optional: faster JSON codec
+except ImportError:
+    orjson = None
 
 # --- Global Object Store ---
 _OBJECT_STORE = {}
+# Monotonic handle ids: never reused within the process, no RNG syscall per handle.
+# The random prefix is drawn once per process so ids from a restarted worker
+# cannot collide with ones a client still holds from the previous process.
+_HANDLE_IDS = itertools.count(1)
+_ID_PREFIX = os.urandom(4).hex()
+
+def _make_id(kind):
+    return f"{kind}_{_ID_PREFIX}{next(_HANDLE_IDS):x}"
 
 def get_session_store(session_id):
     if session_id not in _OBJECT_STORE:
         _OBJECT_STORE[session_id] = {}
     return _OBJECT_STORE[session_id]
 
+# Reverse map per session: id(obj) -> (handle_id, refs). The store holds a strong
+# reference, so id(obj) cannot be recycled while the entry exists.
+_OBJ_INDEX = {}
+
+def get_session_index(session_id):
+    index = _OBJ_INDEX.get(session_id)
+    if index is None:
+        index = _OBJ_INDEX[session_id] = {}
+    return index
+
 # --- Protocol Helpers ---
 def make_response(req_id, value=None, meta=None, error=None):
     if error:
         return {"kind": "error", "req_id": req_id, "error": error}
     return {"kind": "ok", "req_id": req_id, "value": value, "meta": meta}
 
+def _encode_scalar(v, session_id):
+    return {"kind": "value", "value": v}
+
+# Set by serve_msgpack: msgpack carries NaN/Infinity as-is, JSON cannot
+_BINARY_WIRE = False
+
+def _encode_float(v, session_id):
+    # JSON has no NaN/Infinity (orjson silently writes null), so on the JSON wire
+    # non-finite floats go out as handles instead of being corrupted into None
+    if _BINARY_WIRE or math.isfinite(v):
+        return {"kind": "value", "value": v}
+    return _encode_handle(v, session_id)
+
+_SCALAR_TYPES = frozenset((type(None), bool, int, float, str))
+
+def _floats_finite(v):
+    """True if every float in v can be sent as a plain value on the current wire."""
+    return _BINARY_WIRE or all(map(math.isfinite, [x for x in v if type(x) is float]))
+
+# Lists/tuples of plain scalars are built in one comprehension, without recursion
+def _encode_items(v, session_id):
+    if all(type(x) in _SCALAR_TYPES for x in v) and _floats_finite(v):
+        return [{"kind": "value", "value": x} for x in v]
+    enc = encode_value  # LOAD_FAST instead of a global lookup per element
+    return [enc(x, session_id) for x in v]
+
+def _encode_list(v, session_id):
+    return {"kind": "list", "items": _encode_items(v, session_id)}
+
+def _encode_tuple(v, session_id):
+    return {"kind": "tuple", "items": _encode_items(v, session_id)}
+
+def _encode_dict(v, session_id):
+    return {"kind": "dict", "items": [{"key": encode_value(k, session_id), "value": encode_value(val, session_id)} for k, val in v.items()]}
+
+# Exact-type dispatch: one dict lookup instead of an isinstance chain (which walks the MRO).
+# Subclasses (IntEnum, OrderedDict, ...) miss the table and take the isinstance fallback.
+_ENCODERS = {
+    type(None): _encode_scalar,
+    bool: _encode_scalar,
+    int: _encode_scalar,
+    float: _encode_float,
+    str: _encode_scalar,
+    list: _encode_list,
+    tuple: _encode_tuple,
+    dict: _encode_dict,
+}
+
 def encode_value(v, session_id):
     """Encode a Python value to TnkValue."""
-    if v is None:
-        return {"kind": "value", "value": None}
-    if isinstance(v, bool):
-        return {"kind": "value", "value": v}
-    if isinstance(v, (int, float)):
-        return {"kind": "value", "value": v}
-    if isinstance(v, str):
-        return {"kind": "value", "value": v}
+    encoder = _ENCODERS.get(type(v))
+    if encoder is not None:
+        return encoder(v, session_id)
+    if isinstance(v, float):
+        return _encode_float(v, session_id)
+    if isinstance(v, (bool, int, str)):
+        return _encode_scalar(v, session_id)
     if isinstance(v, list):
-        return {"kind": "list", "items": [encode_value(x, session_id) for x in v]}
+        return _encode_list(v, session_id)
     if isinstance(v, tuple):
-        return {"kind": "tuple", "items": [encode_value(x, session_id) for x in v]}
+        return _encode_tuple(v, session_id)
     if isinstance(v, dict):
-        return {"kind": "dict", "items": [{"key": encode_value(k, session_id), "value": encode_value(val, session_id)} for k, val in v.items()]}
+        return _encode_dict(v, session_id)
     
     # Otherwise treat as Handle
-    # Generate ID if not already tracked? 
-    # In real implementation we might use id(v) but here we generate UUID
-    # For prototype, we create a new handle every time it crosses boundary to be safe
-    obj_id = f"h_{uuid.uuid4().hex[:8]}"
-    store = get_session_store(session_id)
-    store[obj_id] = v
+    return _encode_handle(v, session_id)
+
+def _encode_handle(v, session_id):
+    # The same object crossing the boundary again gets the same id (refcounted for delete)
+    index = get_session_index(session_id)
+    entry = index.get(id(v))
+    if entry is not None:
+        obj_id, refs = entry
+        index[id(v)] = (obj_id, refs + 1)
+    else:
+        obj_id = _make_id("h")
+        get_session_store(session_id)[obj_id] = v
+        index[id(v)] = (obj_id, 1)
     return {
         "kind": "handle",
         "id": obj_id,
@@ -50,27 +131,53 @@ def encode_value(v, session_id):
         "session_id": session_id
     }
 
+def _decode_handle(tnk_val, session_id):
+    hid = tnk_val["id"]
+    store = get_session_store(session_id)
+    if hid not in store:
+        raise KeyError(f"StaleHandle: {hid}")
+    return store[hid]
+
+def _decode_items(items, session_id):
+    # All-scalar payloads skip the per-element recursion
+    if all(x.get("kind") == "value" for x in items):
+        return [x["value"] for x in items]
+    return [decode_value(x, session_id) for x in items]
+
+_DECODERS = {
+    "value": lambda tnk_val, session_id: tnk_val["value"],
+    "handle": _decode_handle,
+    "list": lambda tnk_val, session_id: _decode_items(tnk_val["items"], session_id),
+    "tuple": lambda tnk_val, session_id: tuple(_decode_items(tnk_val["items"], session_id)),
+    "dict": lambda tnk_val, session_id: {decode_value(x["key"], session_id): decode_value(x["value"], session_id) for x in tnk_val["items"]},
+}
+
 def decode_value(tnk_val, session_id):
     """Decode TnkValue to Python value."""
     kind = tnk_val.get("kind")
-    if kind == "value":
-        return tnk_val["value"]
-    if kind == "handle":
-        hid = tnk_val["id"]
-        store = get_session_store(session_id)
-        if hid not in store:
-            raise KeyError(f"StaleHandle: {hid}")
-        return store[hid]
-    if kind == "list":
-        return [decode_value(x, session_id) for x in tnk_val["items"]]
-    if kind == "tuple":
-        return tuple(decode_value(x, session_id) for x in tnk_val["items"])
-    if kind == "dict":
-        return {decode_value(x["key"], session_id): decode_value(x["value"], session_id) for x in tnk_val["items"]}
-    raise ValueError(f"Unknown TnkValue kind: {kind}")
+    decoder = _DECODERS.get(kind)
+    if decoder is None:
+        raise ValueError(f"Unknown TnkValue kind: {kind}")
+    return decoder(tnk_val, session_id)
 
 # --- Command Handlers ---
 
+_MISSING = object()
+_WANT_TRACEBACK = os.environ.get("TNK_TRACEBACK") == "1"
+_PLAIN_METHOD_TYPES = (types.FunctionType, types.MethodDescriptorType, types.WrapperDescriptorType)
+
+@functools.lru_cache(maxsize=4096)
+def _lookup_plain_method(tp, name):
+    """(type, name) -> unbound method, only for plain functions/method descriptors
+    on types without a custom __getattribute__ (anything else returns None)."""
+    if tp.__getattribute__ is not object.__getattribute__:
+        return None
+    for klass in tp.__mro__:
+        if name in klass.__dict__:
+            attr = klass.__dict__[name]
+            return attr if isinstance(attr, _PLAIN_METHOD_TYPES) else None
+    return None
+
 def handle_call_method(cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
@@ -82,15 +189,21 @@ def handle_call_method(cmd):
         return make_response(cmd.get("req_id"), error={"code": "StaleHandle", "message": f"Handle {target_id} not found"})
     
     obj = store[target_id]
-    if not hasattr(obj, method_name):
+    # Cached unbound lookup when it is provably equivalent to getattr; otherwise one getattr
+    unbound = None if hasattr(obj, "__dict__") else _lookup_plain_method(type(obj), method_name)
+    func = unbound if unbound is not None else getattr(obj, method_name, _MISSING)
+    if func is _MISSING:
          return make_response(cmd.get("req_id"), error={"code": "PythonException", "py_type": "AttributeError", "message": f"{type(obj)} has no attribute {method_name}"})
     
-    func = getattr(obj, method_name)
     try:
-        result = func(*args)
+        result = unbound(obj, *args) if unbound is not None else func(*args)
         return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
     except Exception as e:
-        return make_response(cmd.get("req_id"), error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e), "traceback": traceback.format_exc()})
+        error = {"code": "PythonException", "py_type": type(e).__name__, "message": str(e)}
+        # Formatting a traceback walks and renders the whole stack; only do it on request
+        if cmd.get("want_traceback", _WANT_TRACEBACK):
+            error["traceback"] = traceback.format_exc()
+        return make_response(cmd.get("req_id"), error=error)
 
 def handle_get_attribute(cmd):
     session_id = cmd["session_id"]
@@ -127,27 +240,26 @@ def handle_get_item(cmd):
     except Exception as e:
         return make_response(cmd.get("req_id"), error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)})
 
+def _slice_arg(arg, session_id):
+    # Spec says: kind:value(number|null) or kind:handle(int)
+    kind = arg["kind"]
+    if kind == "value":
+        return arg["value"]
+    if kind == "handle":
+        val = decode_value(arg, session_id)
+        if not isinstance(val, int):
+            raise TypeError("Slice argument from handle must be int")
+        return val
+    raise ValueError(f"Invalid slice arg kind: {kind}")
+
 def handle_slice(cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
-    
-    # decode start/stop/step
-    # Spec says: kind:value(number|null) or kind:handle(int)
-    def decode_slice_arg(arg):
-        if arg["kind"] == "value":
-            return arg["value"]
-        elif arg["kind"] == "handle":
-            val = decode_value(arg, session_id)
-            if not isinstance(val, int):
-                 raise TypeError("Slice argument from handle must be int")
-            return val
-        else:
-            raise ValueError(f"Invalid slice arg kind: {arg['kind']}")
 
     try:
-        start = decode_slice_arg(cmd["start"])
-        stop = decode_slice_arg(cmd["stop"])
-        step = decode_slice_arg(cmd["step"])
+        start = _slice_arg(cmd["start"], session_id)
+        stop = _slice_arg(cmd["stop"], session_id)
+        step = _slice_arg(cmd["step"], session_id)
         
         if step == 0:
              return make_response(cmd.get("req_id"), error={"code": "PythonException", "py_type": "ValueError", "message": "slice step cannot be zero"})
@@ -180,7 +292,7 @@ def handle_iter(cmd):
     try:
         it = iter(obj)
         # Store iterator as a new handle
-        it_id = f"it_{uuid.uuid4().hex[:8]}"
+        it_id = _make_id("it")
         store[it_id] = it
         
         return make_response(cmd.get("req_id"), value={
@@ -198,19 +310,15 @@ def handle_iter_next_batch(cmd):
     target_id = cmd["target"]
     batch_size = cmd["batch_size"]
     
-    store = get_session_store(session_id)
-    if target_id not in store:
+    it = get_session_store(session_id).get(target_id, _MISSING)
+    if it is _MISSING:
         return make_response(cmd.get("req_id"), error={"code": "StaleHandle", "message": f"Handle {target_id} not found"})
     
-    it = store[target_id]
-    items = []
-    done = False
     try:
-        for _ in range(batch_size):
-            item = next(it)
-            items.append(encode_value(item, session_id))
-    except StopIteration:
-        done = True
+        # Advance in C; a short batch means the iterator is exhausted
+        raw = list(itertools.islice(it, batch_size))
+        done = len(raw) < batch_size
+        items = _encode_items(raw, session_id)
     except Exception as e:
         return make_response(cmd.get("req_id"), error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)})
     
@@ -221,13 +329,22 @@ def handle_delete(cmd):
     target_id = cmd["target"]
     
     store = get_session_store(session_id)
-    if target_id in store:
-        del store[target_id]
+    obj = store.get(target_id, _MISSING)
+    if obj is not _MISSING:
+        # Only drop the object once every handed-out reference has been deleted
+        index = get_session_index(session_id)
+        entry = index.get(id(obj))
+        if entry is not None and entry[0] == target_id and entry[1] > 1:
+            index[id(obj)] = (target_id, entry[1] - 1)
+        else:
+            if entry is not None and entry[0] == target_id:
+                del index[id(obj)]
+            del store[target_id]
     
     return make_response(cmd.get("req_id"), value={"kind": "value", "value": None})
 
 def create_handle(v, session_id):
-    obj_id = f"h_{uuid.uuid4().hex[:8]}"
+    obj_id = _make_id("h")
     store = get_session_store(session_id)
     store[obj_id] = v
     return {
@@ -257,37 +374,122 @@ def handle_debug_eval(cmd):
 
 # --- Main Dispatch Loop ---
 
-DISPATCHER = {
-    "call_method": handle_call_method,
-    "get_attribute": handle_get_attribute,
-    "get_item": handle_get_item,
-    "slice": handle_slice,
-    "iter": handle_iter,
-    "iter_next_batch": handle_iter_next_batch,
-    "delete": handle_delete,
-    "debug_create_string": handle_debug_create_string,
-    "debug_eval": handle_debug_eval,
-}
+# Handlers are addressed by a small integer id. Clients may send "cmd" either as
+# the name (resolved once through CMD_IDS) or directly as the integer id.
+CMD_NAMES = [
+    "call_method",
+    "get_attribute",
+    "get_item",
+    "slice",
+    "iter",
+    "iter_next_batch",
+    "delete",
+    "debug_create_string",
+    "debug_eval",
+]
+HANDLERS = [
+    handle_call_method,
+    handle_get_attribute,
+    handle_get_item,
+    handle_slice,
+    handle_iter,
+    handle_iter_next_batch,
+    handle_delete,
+    handle_debug_create_string,
+    handle_debug_eval,
+]
+CMD_IDS = {name: i for i, name in enumerate(CMD_NAMES)}
+DISPATCHER = dict(zip(CMD_NAMES, HANDLERS))
 
-def main():
-    for line in sys.stdin:
+def dispatch(cmd):
+    cmd_name = cmd.get("cmd")
+    if type(cmd_name) is int:
+        cmd_id = cmd_name
+    else:
+        cmd_id = CMD_IDS.get(cmd_name, -1)
+    if not 0 <= cmd_id < len(HANDLERS):
+        return make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": f"Unknown command {cmd_name}"})
+    return HANDLERS[cmd_id](cmd)
+
+def _dump_line(resp):
+    """Serialize a response as one NDJSON line (bytes)."""
+    if orjson is not None:
+        try:
+            # OPT_APPEND_NEWLINE avoids copying the whole payload to add b"\n"
+            return orjson.dumps(resp, option=orjson.OPT_APPEND_NEWLINE)
+        except (orjson.JSONEncodeError, TypeError):
+            # e.g. ints wider than 64 bits: let the stdlib handle them
+            pass
+    return (json.dumps(resp) + "\n").encode("utf-8")
+
+def serve_json_lines():
+    """Default framing: one JSON object per line (what the Rust bridge speaks).
+
+    Reads and writes the binary streams directly; uses orjson when available.
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    stdout = sys.stdout.buffer
+    for line in sys.stdin.buffer:
         line = line.strip()
         if not line:
             continue
         try:
-            cmd = json.loads(line)
-            cmd_name = cmd.get("cmd")
-            if cmd_name in DISPATCHER:
-                resp = DISPATCHER[cmd_name](cmd)
-            else:
-                resp = make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": f"Unknown command {cmd_name}"})
+            cmd = loads(line)
+            resp = dispatch(cmd)
         except json.JSONDecodeError:
              resp = make_response(None, error={"code": "ProtocolError", "message": "Invalid JSON"})
         except Exception as e:
              resp = make_response(None, error={"code": "WorkerCrash", "message": str(e), "traceback": traceback.format_exc()})
         
-        print(json.dumps(resp))
-        sys.stdout.flush()
+        stdout.write(_dump_line(resp))
+        stdout.flush()
+
+def serve_msgpack(msgpack):
+    """Opt-in framing: <u32 little-endian length><msgpack payload> in both directions."""
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    global _BINARY_WIRE
+    _BINARY_WIRE = True
+    # packb builds a fresh Packer per call; keep one for the whole session
+    pack = msgpack.Packer(use_bin_type=True).pack
+    while True:
+        header = stdin.read(4)
+        if len(header) < 4:
+            break
+        (size,) = struct.unpack("<I", header)
+        payload = stdin.read(size)
+        if len(payload) < size:
+            break
+        # Only the decode is a frame error; handler failures keep the request's req_id
+        try:
+            cmd = msgpack.unpackb(payload, raw=False)
+        except (msgpack.UnpackException, ValueError):
+            resp = make_response(None, error={"code": "ProtocolError", "message": "Invalid msgpack frame"})
+        else:
+            try:
+                resp = dispatch(cmd)
+            except Exception as e:
+                req_id = cmd.get("req_id") if isinstance(cmd, dict) else None
+                resp = make_response(req_id, error={"code": "WorkerCrash", "message": str(e), "traceback": traceback.format_exc()})
+
+        try:
+            out = pack(resp)
+        except Exception as e:
+            # e.g. ints wider than 64 bits: report it for this req_id instead of killing the loop
+            out = pack(make_response(resp.get("req_id"), error={"code": "ProtocolError", "message": f"Response could not be serialized: {type(e).__name__}: {e}"}))
+        stdout.write(struct.pack("<I", len(out)) + out)
+        stdout.flush()
+
+def main():
+    if "--msgpack" in sys.argv[1:]:
+        try:
+            import msgpack
+        except ImportError:
+            print("msgpack is not installed; falling back to JSON lines", file=sys.stderr)
+        else:
+            serve_msgpack(msgpack)
+            return
+    serve_json_lines()
 
 if __name__ == "__main__":
     main()
@@ -342,3 +342,18 @@ pub static BUILTIN_MAP: Lazy<HashMap<&'static str, &'static BuiltinSpec>> = Lazy
 pub fn get_builtin_spec(name: &str) -> Option<&'static BuiltinSpec> {
     BUILTIN_MAP.get(name).copied()
 }
+
+/// BuiltinId から BuiltinSpec を検索するためのマップ (lowering で毎回線形探索しないため)
+pub static BUILTIN_ID_MAP: Lazy<HashMap<BuiltinId, &'static BuiltinSpec>> = Lazy::new(|| {
+    let mut m = HashMap::new();
+    for spec in BUILTIN_SPECS {
+        // 同じ ID が複数あれば、線形探索と同じく先頭の定義を使う
+        m.entry(spec.id).or_insert(spec);
+    }
+    m
+});
+
+/// BuiltinId から仕様を取得
+pub fn get_builtin_spec_by_id(id: BuiltinId) -> Option<&'static BuiltinSpec> {
+    BUILTIN_ID_MAP.get(&id).copied()
+}
@@ -7,9 +7,27 @@ Supports multiple sessions, robust error handling, and batched iteration.
 
 import sys
 import json
-import uuid
+import itertools
 import traceback
 import importlib
+import os
+import struct
+import base64
+import math
+import array
+import functools
+import operator
+import types
+import threading
+import time
+import socket
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson  # 任意: 高速な JSON コーデック
+except ImportError:
+    orjson = None
 
 # --- Diagnostics (V1.7.0 Robustness) ---
 try:
@@ -21,25 +39,42 @@ except Exception as e:
 # ---------------------------------------
 
 # --- Global State ---
-# _SESSIONS[session_id] = { "objects": {id: obj}, "modules": {name: module} }
+# _SESSIONS[session_id] = { "objects": {id: obj}, "modules": {name: module}, "obj_index": {id(obj): (id, refs)}, "lock": Lock }
 _SESSIONS = {}
+# ハンドル ID はプロセス内で単調増加 (uuid4 は OS 乱数 + hex 変換で遅い)。
+# セッションをまたいでも再利用されないので、古い ID が別オブジェクトを指すことはない。
+# 先頭の乱数はプロセス起動時に1回だけ引く。ワーカー再起動後に前のプロセスの ID が
+# 新しいオブジェクトに当たってしまうのを防ぐ。
+_HANDLE_IDS = itertools.count(1)
+# dict.get の「見つからない」印 (None を値として保持できるように専用オブジェクトを使う)
+_MISSING = object()
+_ID_PREFIX = os.urandom(4).hex()
+
+def _make_id(kind):
+    return f"{kind}_{_ID_PREFIX}{next(_HANDLE_IDS):x}"
+
+# encode_value はオブジェクトごとに ID を振るので、関数呼び出しを挟まずに組み立てる
+_HANDLE_PREFIX = f"h_{_ID_PREFIX}"
 
 # --- Security Policy (V1.7.0) ---
-FORBIDDEN_CALLS = {"eval", "exec", "globals", "locals"}
+# ハンドラでは関数呼び出しを挟まず `name in FORBIDDEN_CALLS` で直接判定する
+FORBIDDEN_CALLS = frozenset({"eval", "exec", "globals", "locals"})
 
 def is_forbidden_name(name):
     return name in FORBIDDEN_CALLS
 
 def is_forbidden_target(target_str):
-    # "builtins.eval" -> "eval"
-    parts = target_str.split(".")
-    tail = parts[-1] if parts else target_str
-    return is_forbidden_name(tail)
+    # "builtins.eval" -> "eval" (rpartition は分割リストを作らない)
+    return target_str.rpartition(".")[2] in FORBIDDEN_CALLS
 
 def get_session(session_id):
-    if session_id not in _SESSIONS:
-        _SESSIONS[session_id] = {"objects": {}, "modules": {}}
-    return _SESSIONS[session_id]
+    session = _SESSIONS.get(session_id)
+    if session is None:
+        # obj_index: id(obj) -> (handle_id, 参照数)。同じオブジェクトは同じハンドルを返す
+        # lock: TNK_WORKER_THREADS 使用時にこのセッションの状態を触る処理を直列化する
+        # (setdefault なので別スレッドが同時に作っても同じ dict に揃う)
+        session = _SESSIONS.setdefault(session_id, {"objects": {}, "modules": {}, "obj_index": {}, "lock": threading.Lock()})
+    return session
 
 # --- Protocol Helpers ---
 
@@ -58,56 +93,218 @@ def make_response(req_id, value=None, meta=None, error=None, op_info=None):
         if op_info:
             error["op"] = op_info
         return {"kind": "error", "req_id": req_id, "error": error}
+    if meta is None:
+        # meta は省略可 (Rust 側は Option) なので、無いときは "meta": null を送らない
+        return {"kind": "ok", "req_id": req_id, "value": value}
     return {"kind": "ok", "req_id": req_id, "value": value, "meta": meta}
 
-def encode_value(v, session_id):
-    """Encode a Python value to TnkValue."""
-    if v is None:
-        return {"kind": "value", "value": None}
-    if isinstance(v, bool):
-        # Bool must come before int check because isinstance(True, int) is True
-        return {"kind": "value", "value": v}
-    if isinstance(v, (int, float)):
-        return {"kind": "value", "value": v}
+# delete などの「戻り値なし」応答は毎回同じ中身なので共有する (直列化されるだけで変更されない)
+_NONE_VALUE = {"kind": "value", "value": None}
+
+# 単一スカラーの戻り値が最頻出。2キーの小さな dict は copy() (キー表を共有) の方が
+# リテラル構築より速い。要素数の多いリストの内包表記ではリテラルの方が速いのでそのまま。
+_VALUE_TEMPLATE = {"kind": "value", "value": None}
+
+def _encode_scalar(v, session_id, describe=True):
+    d = _VALUE_TEMPLATE.copy()
+    d["value"] = v
+    return d
+
+def _encode_float(v, session_id, describe=True):
+    """float (サブクラスを含む) を値にする。JSON ワイヤで有限でないものはハンドルにする
+
+    JSON は NaN/±Infinity を表せず、orjson は黙って null にする (None に化ける)。
+    msgpack/pickle はそのまま運べるので値で返す。
+    """
+    if _BINARY_WIRE or math.isfinite(v):
+        d = _VALUE_TEMPLATE.copy()
+        d["value"] = v
+        return d
+    return _encode_handle(v, session_id, describe)
+
+# None / True / False は中身が決まっているので共有の dict を返す (応答は直列化されるだけで変更されない)
+_TRUE_VALUE = {"kind": "value", "value": True}
+_FALSE_VALUE = {"kind": "value", "value": False}
+
+def _encode_none(v, session_id, describe=True):
+    return _NONE_VALUE
+
+def _encode_bool(v, session_id, describe=True):
+    return _TRUE_VALUE if v else _FALSE_VALUE
+
+_SCALAR_TYPES = frozenset((type(None), bool, int, float, str))
+# JSON ワイヤでそのまま値にできる型 (float は有限か確かめてから)
+_JSON_SCALAR_TYPES = frozenset((type(None), bool, int, str))
+
+def _floats_finite(v):
+    """v に含まれる float がすべて有限か (JSON ワイヤでは NaN/±Infinity を値にできない)"""
+    return _BINARY_WIRE or all(map(math.isfinite, [x for x in v if type(x) is float]))
+
+# プリミティブだけの list/tuple は再帰せずに内包表記 1 回で組み立てる
+def _encode_items(v, session_id, describe=True):
+    if all(type(x) in _SCALAR_TYPES for x in v) and _floats_finite(v):
+        return [{"kind": "value", "value": x} for x in v]
+    return _encode_tree(v, "list", session_id, describe)["items"]
+
+_CONTAINER_TYPES = {list: "list", tuple: "tuple", dict: "dict"}
+
+def _encode_children(v, kind):
+    # dict は key, value, key, value ... の並びにして list/tuple と同じループで扱う
+    return list(itertools.chain.from_iterable(v.items())) if kind == "dict" else v
+
+def _encode_container(kind, out):
+    if kind == "dict":
+        return {"kind": "dict", "items": [{"key": k, "value": val} for k, val in zip(out[::2], out[1::2])]}
+    return {"kind": kind, "items": out}
+
+def _encode_tree(root, kind, session_id, describe=True):
+    """入れ子の list/tuple/dict を明示スタックでエンコードする
+
+    要素ごとの再帰呼び出し (フレーム生成) を避け、深い入れ子でも RecursionError にならない。
+    コンテナ以外の要素だけ encode_value に渡す (JSON ワイヤの float は _encode_float で有限か確かめる)。
+    """
+    scalar_types = _SCALAR_TYPES if _BINARY_WIRE else _JSON_SCALAR_TYPES
+    container_types, enc = _CONTAINER_TYPES, encode_value
+    stack = []
+    frame = [kind, _encode_children(root, kind), 0, []]
+    while True:
+        kind, children, i, out = frame
+        n = len(children)
+        while i < n:
+            child = children[i]
+            i += 1
+            tp = type(child)
+            if tp in scalar_types:
+                out.append({"kind": "value", "value": child})
+                continue
+            child_kind = container_types.get(tp)
+            if child_kind is not None:
+                break
+            out.append(enc(child, session_id, describe))
+        else:
+            # このコンテナの要素が揃った: 親に積んで続きから再開する
+            value = _encode_container(kind, out)
+            if not stack:
+                return value
+            frame = stack.pop()
+            frame[3].append(value)
+            continue
+        frame[2] = i
+        stack.append(frame)
+        frame = [child_kind, _encode_children(child, child_kind), 0, []]
+
+def _encode_list(v, session_id, describe=True):
+    return {"kind": "list", "items": _encode_items(v, session_id, describe)}
+
+def _encode_tuple(v, session_id, describe=True):
+    return {"kind": "tuple", "items": _encode_items(v, session_id, describe)}
+
+def _encode_dict(v, session_id, describe=True):
+    return _encode_tree(v, "dict", session_id, describe)
+
+# 完全一致の型は dict 1回の参照で振り分ける (isinstance の連鎖は MRO を辿るため)。
+# type(True) is bool なので bool/int の順序問題も起きない。
+# テーブルに無い型は初回に _encoder_for_type で振り分け先を決めて追加する。
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_scalar,
+    float: _encode_float,
+    str: _encode_scalar,
+    list: _encode_list,
+    tuple: _encode_tuple,
+    dict: _encode_dict,
+}
+
+def _describe(v, type_name):
+    """ハンドル表示用の (repr, str)。どちらも 200 文字で切り詰める"""
+    try:
+        repr_str = repr(v)
+        if len(repr_str) > 200:
+            repr_str = repr_str[:197] + "..."
+    except:
+        repr_str = f"<{type_name} object>"
+
+    if type(v).__str__ is object.__str__:
+        # __str__ 未定義の型は str() == repr() なので2回目のフォーマットを省く
+        str_str = repr_str
+    else:
+        try:
+            str_str = str(v)
+            if len(str_str) > 200:
+                str_str = str_str[:197] + "..."
+        except:
+            str_str = repr_str
+    return repr_str, str_str
+
+def _encoder_for_type(tp):
+    """テーブルに無い型の振り分け先 (型だけで決まるものはスカラー扱い、残りは _encode_other)"""
+    if issubclass(tp, float):
+        # numpy.float64 など。JSON ワイヤで有限でなければハンドルになる
+        return _encode_float
+    if issubclass(tp, int):
+        # bool/int のサブクラス (IntEnum など) は常に値として返す
+        return _encode_scalar
+    return _encode_other
+
+def encode_value(v, session_id, describe=True):
+    """Encode a Python value to TnkValue.
+
+    describe=False ならハンドルの repr/str を計算せず "<型名>" で埋める
+    (巨大な配列や DataFrame の repr は全体を走査するため)。
+    """
+    tp = type(v)
+    encoder = _ENCODERS.get(tp)
+    if encoder is None:
+        encoder = _ENCODERS[tp] = _encoder_for_type(tp)
+    return encoder(v, session_id, describe)
+
+def _encode_other(v, session_id, describe=True):
+    """値ごとに判定が要る型: numpy スカラー等の item()、コンテナのサブクラス、それ以外はハンドル"""
     # Scalar-like objects (e.g., numpy scalars) -> convert via item() generically
+    # (多次元配列の item() は必ず例外になるので ndim で先に弾く)
+    # hasattr + getattr の二重参照を避け、getattr 1回で取り出す
     try:
-        if hasattr(v, "item") and callable(getattr(v, "item")):
-            return encode_value(v.item(), session_id)
+        if getattr(v, "ndim", 0) == 0:
+            item = getattr(v, "item", None)
+            if callable(item):
+                return encode_value(item(), session_id, describe)
     except Exception:
         pass
     if isinstance(v, str):
-        return {"kind": "value", "value": v}
+        return _encode_scalar(v, session_id)
     if isinstance(v, (list, tuple)):
-        # Recursively encode list/tuple. Note: numpy arrays etc should be handles?
+        # Note: numpy arrays etc should be handles?
         # Maximum A spec says primitives. 
         # For simplicity in V1.7.0, lists of primitives are lists, 
         # but lists of complex objects... technically TnkValue can contain Handles.
-        kind = "list" if isinstance(v, list) else "tuple"
-        return {"kind": kind, "items": [encode_value(x, session_id) for x in v]}
+        # サブクラス (namedtuple など) も中身は _encode_tree で再帰せずに辿る
+        return _encode_tree(v, "list" if isinstance(v, list) else "tuple", session_id, describe)
     if isinstance(v, dict):
-        return {"kind": "dict", "items": [{"key": encode_value(k, session_id), "value": encode_value(val, session_id)} for k, val in v.items()]}
+        return _encode_tree(v, "dict", session_id, describe)
     
     # Everything else is a Handle
-    # Check if object already has ID? (Not strictly required for Opaque Handle, but nice for equality)
-    # For V1.7.0, we just create a new handle.
-    obj_id = f"h_{uuid.uuid4().hex[:16]}"
+    return _encode_handle(v, session_id, describe)
+
+def _encode_handle(v, session_id, describe=True):
+    """v をセッションに登録し {"kind": "handle"} を返す"""
+    # 既にハンドルを持つオブジェクトは同じ ID を返す (objects が強参照を持つので id(v) は再利用されない)
     session = get_session(session_id)
-    session["objects"][obj_id] = v
+    obj_index = session["obj_index"]
+    entry = obj_index.get(id(v))
+    if entry is not None:
+        obj_id, refs = entry
+        obj_index[id(v)] = (obj_id, refs + 1)
+    else:
+        obj_id = f"{_HANDLE_PREFIX}{next(_HANDLE_IDS):x}"
+        session["objects"][obj_id] = v
+        obj_index[id(v)] = (obj_id, 1)
     
     type_name = type(v).__name__
-    try:
-        repr_str = repr(v)
-        if len(repr_str) > 200:
-            repr_str = repr_str[:197] + "..."
-    except:
-        repr_str = f"<{type_name} object>"
-
-    try:
-        str_str = str(v)
-        if len(str_str) > 200:
-            str_str = str_str[:197] + "..."
-    except:
-        str_str = repr_str
+    if describe:
+        repr_str, str_str = _describe(v, type_name)
+    else:
+        repr_str = str_str = f"<{type_name}>"
 
     return {
         "kind": "handle",
@@ -118,91 +315,264 @@ def encode_value(v, session_id):
         "session_id": session_id
     }
 
+_get_kind = operator.itemgetter("kind")
+_ONLY_VALUE_KINDS = frozenset(("value",))
+
+def _decode_items(items, session_id):
+    # 全要素が kind:value なら再帰せずに値を取り出す。
+    # kind の収集は itemgetter + set で C 側のループに任せる (ジェネレータより速い)
+    try:
+        only_values = set(map(_get_kind, items)) == _ONLY_VALUE_KINDS
+    except KeyError:
+        only_values = False  # kind 欠落は下の decode_value でエラーにする
+    if only_values:
+        return [x["value"] for x in items]
+    return _decode_tree("list", items, session_id)
+
+_CONTAINER_KINDS = frozenset(("list", "tuple", "dict"))
+
+def _decode_children(tnk_val, kind):
+    items = tnk_val["items"]
+    if kind == "dict":
+        return [x for item in items for x in (item["key"], item["value"])]
+    return items
+
+def _decode_container(kind, out):
+    if kind == "list":
+        return out
+    if kind == "tuple":
+        return tuple(out)
+    return dict(zip(out[::2], out[1::2]))
+
+def _decode_tree(kind, children, session_id):
+    """入れ子の list/tuple/dict を明示スタックで復元する (_encode_tree の逆)"""
+    decoders = _DECODERS
+    stack = []
+    frame = [kind, children, 0, []]
+    while True:
+        kind, children, i, out = frame
+        n = len(children)
+        while i < n:
+            child = children[i]
+            i += 1
+            child_kind = child.get("kind")
+            if child_kind in _CONTAINER_KINDS:
+                break
+            decoder = decoders.get(child_kind)
+            if decoder is None:
+                raise ValueError(f"Unknown TnkValue kind: {child_kind}")
+            out.append(decoder(child, session_id))
+        else:
+            value = _decode_container(kind, out)
+            if not stack:
+                return value
+            frame = stack.pop()
+            frame[3].append(value)
+            continue
+        frame[2] = i
+        stack.append(frame)
+        frame = [child_kind, _decode_children(child, child_kind), 0, []]
+
+def _decode_scalar(tnk_val, session_id):
+    return tnk_val["value"]
+
+def _decode_handle(tnk_val, session_id):
+    hid = tnk_val["id"]
+    # handle.session_id は検証用。別セッションのハンドルは共有ストアが無いので
+    # V1.7.0 では要求元セッションのスコープで探す。
+    obj = get_session(session_id)["objects"].get(hid, _MISSING) # Using request's session scope
+    if obj is _MISSING:
+         raise KeyError(f"StaleHandle: {hid} (Session: {session_id})")
+    return obj
+
+def _decode_list(tnk_val, session_id):
+    return _decode_items(tnk_val["items"], session_id)
+
+def _decode_tuple(tnk_val, session_id):
+    return tuple(_decode_items(tnk_val["items"], session_id))
+
+def _decode_dict(tnk_val, session_id):
+    items = tnk_val["items"]
+    # キーも値も kind:value なら list/tuple と同様に再帰しない
+    if all(x["key"].get("kind") == "value" and x["value"].get("kind") == "value" for x in items):
+        return {x["key"]["value"]: x["value"]["value"] for x in items}
+    return _decode_tree("dict", _decode_children(tnk_val, "dict"), session_id)
+
+def _decode_ndarray(tnk_val, session_id):
+    import numpy
+    data = tnk_val["data"]
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    # frombuffer は読み取り専用ビューなので、書き換え可能な配列にコピーする
+    return numpy.frombuffer(data, dtype=tnk_val["dtype"]).reshape(tnk_val["shape"]).copy()
+
+def _decode_bytes(tnk_val, session_id):
+    data = tnk_val["data"]
+    return base64.b64decode(data) if isinstance(data, str) else bytes(data)
+
+def _decode_primitive_batch(tnk_val, session_id):
+    # items は素のプリミティブ配列なので、要素ごとの decode を通さずそのまま使う
+    return tnk_val["items"]
+
+def _decode_packed(tnk_val, session_id):
+    data = tnk_val["data"]
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    return array.array(tnk_val["dtype"], data).tolist()
+
+# kind タグで 1 回の dict 参照で振り分ける
+_DECODERS = {
+    "value": _decode_scalar,
+    "handle": _decode_handle,
+    "list": _decode_list,
+    "tuple": _decode_tuple,
+    "dict": _decode_dict,
+    "ndarray": _decode_ndarray,
+    "bytes": _decode_bytes,
+    "primitive_batch": _decode_primitive_batch,
+    "packed": _decode_packed,
+}
+
 def decode_value(tnk_val, session_id):
     """Decode TnkValue to Python value."""
     kind = tnk_val.get("kind")
-    if kind == "value":
-        return tnk_val["value"]
-    if kind == "handle":
-        hid = tnk_val["id"]
-        # Allow cross-session handles? No, spec says session_id must match? 
-        # Actually spec says: "handle.session_id is for verification".
-        # If handle points to another session, we probably can't resolve it unless we look globally.
-        # But for strictness:
-        h_sid = tnk_val.get("session_id")
-        if h_sid and h_sid != session_id:
-             # If we want to support sharing, we'd need global store. 
-             # For V1.7.0, let's look in the requesting session.
-             pass 
-
-        session = get_session(session_id) # Using request's session scope
-        if hid not in session["objects"]:
-             # Check if it was session mismatch
-             raise KeyError(f"StaleHandle: {hid} (Session: {session_id})")
-        return session["objects"][hid]
-    
-    if kind == "list":
-        return [decode_value(x, session_id) for x in tnk_val["items"]]
-    if kind == "tuple":
-        return tuple(decode_value(x, session_id) for x in tnk_val["items"])
-    if kind == "dict":
-        return {decode_value(x["key"], session_id): decode_value(x["value"], session_id) for x in tnk_val["items"]}
-    
-    raise ValueError(f"Unknown TnkValue kind: {kind}")
+    decoder = _DECODERS.get(kind)
+    if decoder is None:
+        raise ValueError(f"Unknown TnkValue kind: {kind}")
+    return decoder(tnk_val, session_id)
+
+# traceback.format_exc() はフレームを辿ってソース行まで整形するので重い。
+# 既定では型とメッセージだけ返し、cmd の want_traceback (または TNK_TRACEBACK=1) で付ける。
+_WANT_TRACEBACK = os.environ.get("TNK_TRACEBACK") == "1"
+
+def _stale_response(req_id, target_id, op_info=None):
+    """削除済み/未知のハンドルを指定されたときの StaleHandle レスポンス"""
+    return make_response(req_id, error={"code": "StaleHandle", "message": f"Handle {target_id} not found"}, op_info=op_info)
+
+def _exc_response(req_id, e, want_tb, op_info=None):
+    """ハンドラ内で捕捉した例外を PythonException レスポンスにする"""
+    error = {"code": "PythonException", "py_type": type(e).__name__, "message": str(e)}
+    if want_tb:
+        error["traceback"] = traceback.format_exc()
+    return make_response(req_id, error=error, op_info=op_info)
+
+def _encode_result(result, session_id, cmd):
+    """ハンドラの戻り値をエンコードする
+
+    cmd に inline_arrays が立っていれば numpy 配列をハンドルにせず kind:value の
+    中身として返し、orjson (OPT_SERIALIZE_NUMPY) にそのまま数値配列へ直列化させる。
+    この場合クライアントは value に JSON 配列 (入れ子可) が来ることを受け入れる必要がある。
+    inline_arrays="binary" なら ndarray は get_buffer と同じ {"kind": "ndarray"} で、
+    bytes/bytearray/memoryview は {"kind": "bytes"} で、
+    長い同一型数値リストは {"kind": "packed"/"primitive_batch"} でまとめて返す。
+    want_repr=false ならハンドルの repr/str を省く (必要になったら describe で取る)。
+    """
+    inline = cmd.get("inline_arrays")
+    if inline:
+        numpy = sys.modules.get("numpy")
+        if numpy is not None and isinstance(result, numpy.ndarray):
+            if inline == "binary":
+                return encode_buffer(result)
+            # NaN/±Infinity を含む float 配列は JSON 配列にできないので、下のハンドルで返す
+            if result.dtype.kind != "f" or numpy.isfinite(result).all():
+                return _encode_scalar(result if orjson is not None else result.tolist(), session_id)
+        if inline == "binary":
+            if isinstance(result, (bytes, bytearray, memoryview)):
+                return _encode_bytes(result)
+            if type(result) is list and len(result) > _COLUMNAR_MIN_LEN:
+                value = _encode_columnar(result)
+                if value is not None:
+                    return value
+    return encode_value(result, session_id, cmd.get("want_repr", True))
 
 # --- Logic ---
 
-def resolve_callable(target_str, session_id):
-    """Resolve 'numpy.array' -> function object."""
-    parts = target_str.split(".")
-    if not parts:
-        raise ValueError("Empty target")
+class _ForbiddenTarget(ValueError):
+    """禁止名 (FORBIDDEN_CALLS) で終わるドット区切りターゲット"""
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_cached(target_str):
+    """'numpy.array' -> オブジェクト (プロセス全体でキャッシュ。失敗は例外なのでキャッシュされない)
+
+    禁止名の判定もここで行う。キャッシュに載るのは判定を通ったターゲットだけなので、
+    2回目以降は lru_cache の参照1回で解決と判定の両方が済む。
+    """
+    if target_str.rpartition(".")[2] in FORBIDDEN_CALLS:
+        raise _ForbiddenTarget(f"Forbidden function call: {target_str}")
+    module_name, _, rest = target_str.partition(".")
     
     # Try dynamic import structure
     # 1. Try importing the first part as module
-    module_name = parts[0]
-    session = get_session(session_id)
-    
-    # Cache in session modules? Or global?
-    # Python modules are global sys.modules, but we can cache ref in session if needed.
-    
     try:
         current_obj = importlib.import_module(module_name)
     except ImportError:
         # Maybe it's a builtin?
         import builtins
-        if hasattr(builtins, module_name):
-            current_obj = getattr(builtins, module_name)
-        else:
+        current_obj = getattr(builtins, module_name, _MISSING)
+        if current_obj is _MISSING:
              raise
              
-    # Traverse the rest
-    for part in parts[1:]:
-        current_obj = getattr(current_obj, part)
+    # Traverse the rest (attrgetter は C レベルでドット区切りを辿る)
+    if rest:
+        current_obj = operator.attrgetter(rest)(current_obj)
         
     return current_obj
 
-def resolve_target(target, session_id):
+def resolve_callable(target_str, session_id):
+    """Resolve 'numpy.array' -> function object.
+
+    解決結果は session に依存しないので _resolve_cached で共有する。
+    """
+    if not target_str:
+        raise ValueError("Empty target")
+    return _resolve_cached(target_str)
+
+def resolve_target(target, session):
     """Resolve target (Handle ID or Module definition) to a Python object."""
     if isinstance(target, dict) and target.get("kind") == "module":
         # Target is a module: {"kind": "module", "module": "cv2"}
-        module_name = target["module"]
-        return resolve_callable(module_name, session_id)
+        return _resolve_cached(target["module"])
     
     # Otherwise, assume target is a Handle ID (string)
     if not isinstance(target, str):
          raise ValueError(f"Invalid target format: {target}")
          
-    session = get_session(session_id)
-    if target not in session["objects"]:
+    obj = session["objects"].get(target, _MISSING)
+    if obj is _MISSING:
         raise ValueError(f"StaleHandle: {target}")
-        
-    return session["objects"][target]
+    return obj
+
+
+# エラー応答に付けるオペレーション情報。成功時には使わないので、失敗した分岐でだけ cmd から組み立てる
+
+def _call_function_op(cmd):
+    return {"cmd": "call_function", "target": cmd["target"], "args": cmd["args"], "kwargs": cmd.get("kwargs") or {}}
+
+def _call_method_op(cmd):
+    return {"cmd": "call_method", "target": cmd["target"], "method": cmd["method"], "args": cmd["args"], "kwargs": cmd.get("kwargs") or {}}
+
+def _get_attribute_op(cmd):
+    return {"cmd": "get_attribute", "target": cmd["target"], "name": cmd["name"]}
+
+def _get_item_op(cmd):
+    # key は元の TnkValue 形式のまま
+    return {"cmd": "get_item", "target": cmd["target"], "key": cmd["key"]}
 
+def _slice_op(cmd):
+    return {"cmd": "slice", "target": cmd["target"], "start": cmd["start"], "stop": cmd["stop"], "step": cmd["step"]}
+
+def _iter_op(cmd):
+    return {"cmd": "iter", "target": cmd["target"]}
+
+def _iter_next_batch_op(cmd):
+    return {"cmd": "iter_next_batch", "target": cmd["target"], "batch_size": cmd.get("batch_size", 1000)}
+
+def _get_buffer_op(cmd):
+    return {"cmd": "get_buffer", "target": cmd["target"]}
 
 # --- Command Handlers ---
 
-def handle_call_function(cmd):
+def handle_call_function(session, cmd):
     """NEW: Call a global function or static method by string path. 
     e.g. target="numpy.array", args=[...], kwargs={...}
     """
@@ -213,54 +583,55 @@ def handle_call_function(cmd):
     args = [decode_value(a, session_id) for a in args_raw]
     kwargs = {k: decode_value(v, session_id) for k, v in kwargs_raw.items()}
 
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "call_function",
-        "target": target_str,
-        "args": args_raw,
-        "kwargs": kwargs_raw
-    }
-
-    if is_forbidden_target(target_str):
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "SecurityViolation", "message": f"Forbidden function call: {target_str}"},
-            op_info=op_info
-        )
-    
     func = None
     try:
         func = resolve_callable(target_str, session_id)
+    except _ForbiddenTarget as e:
+        return make_response(
+            cmd.get("req_id"), 
+            error={"code": "SecurityViolation", "message": str(e)},
+            op_info=_call_function_op(cmd)
+        )
     except ImportError:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": "ImportError", "message": f"Module implementation not found: {target_str}"},
-            op_info=op_info
+            op_info=_call_function_op(cmd)
         )
     except AttributeError:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": "AttributeError", "message": f"Attribute not found: {target_str}"},
-            op_info=op_info
+            op_info=_call_function_op(cmd)
         )
     except Exception as e:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e), "traceback": traceback.format_exc()},
-            op_info=op_info
-        )
+        return _exc_response(cmd.get("req_id"), e, cmd.get("want_traceback", _WANT_TRACEBACK), _call_function_op(cmd))
 
     try:
         result = func(*args, **kwargs)
-        return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
+        return make_response(cmd.get("req_id"), value=_encode_result(result, session_id, cmd))
     except Exception as e:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e), "traceback": traceback.format_exc()},
-            op_info=op_info
-        )
+        return _exc_response(cmd.get("req_id"), e, cmd.get("want_traceback", _WANT_TRACEBACK), _call_function_op(cmd))
+
+_PLAIN_METHOD_TYPES = (types.FunctionType, types.MethodDescriptorType, types.WrapperDescriptorType)
 
-def handle_call_method(cmd):
+@functools.lru_cache(maxsize=4096)
+def _lookup_plain_method(tp, name):
+    """(型, メソッド名) -> 非バインドのメソッド (キャッシュ付き)
+
+    インスタンス辞書を持たず __getattribute__ を上書きしていない型で、
+    クラス側の定義が普通の関数/メソッドデスクリプタの場合のみ返す。
+    それ以外 (モジュール, classmethod, property 等) は None で通常の getattr に任せる。
+    """
+    if tp.__getattribute__ is not object.__getattribute__:
+        return None
+    for klass in tp.__mro__:
+        if name in klass.__dict__:
+            attr = klass.__dict__[name]
+            return attr if isinstance(attr, _PLAIN_METHOD_TYPES) else None
+    return None
+
+def handle_call_method(session, cmd):
     session_id = cmd["session_id"]
     target = cmd["target"]
     method_name = cmd["method"]
@@ -269,303 +640,534 @@ def handle_call_method(cmd):
     args = [decode_value(a, session_id) for a in args_raw]
     kwargs = {k: decode_value(v, session_id) for k, v in kwargs_raw.items()}
 
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "call_method",
-        "target": target,
-        "method": method_name,
-        "args": args_raw,
-        "kwargs": kwargs_raw
-    }
-
-    if is_forbidden_name(method_name):
+    if method_name in FORBIDDEN_CALLS:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "SecurityViolation", "message": f"Forbidden method call: {method_name}"},
-            op_info=op_info
+            op_info=_call_method_op(cmd)
         )
     
     try:
-        obj = resolve_target(target, session_id)
+        obj = resolve_target(target, session)
+    except _ForbiddenTarget as e:
+        return make_response(
+            cmd.get("req_id"), 
+            error={"code": "SecurityViolation", "message": str(e)},
+            op_info=_call_method_op(cmd)
+        )
     except ValueError as e:
         if "StaleHandle" in str(e):
             return make_response(
                 cmd.get("req_id"), 
                 error={"code": "StaleHandle", "message": str(e)},
-                op_info=op_info
+                op_info=_call_method_op(cmd)
             )
         return make_response(
             cmd.get("req_id"), 
             error={"code": "ProtocolError", "message": str(e)},
-            op_info=op_info
+            op_info=_call_method_op(cmd)
         )
 
-    if not hasattr(obj, method_name):
+    # キャッシュ済みの非バインドメソッドがあれば bound method を作らずに呼ぶ
+    unbound = None
+    if not hasattr(obj, "__dict__"):
+        unbound = _lookup_plain_method(type(obj), method_name)
+    func = unbound if unbound is not None else getattr(obj, method_name, _MISSING)
+    if func is _MISSING:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": "AttributeError", "message": f"{type(obj)} has no attribute {method_name}"},
-            op_info=op_info
+            op_info=_call_method_op(cmd)
         )
     
-    func = getattr(obj, method_name)
     try:
-        result = func(*args, **kwargs)
-        return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
+        if unbound is not None:
+            result = unbound(obj, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        return make_response(cmd.get("req_id"), value=_encode_result(result, session_id, cmd))
     except Exception as e:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e), "traceback": traceback.format_exc()},
-            op_info=op_info
-        )
+        return _exc_response(cmd.get("req_id"), e, cmd.get("want_traceback", _WANT_TRACEBACK), _call_method_op(cmd))
 
-def handle_get_attribute(cmd):
+def handle_get_attribute(session, cmd):
     session_id = cmd["session_id"]
     target = cmd["target"]
     attr_name = cmd["name"]
-    
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "get_attribute",
-        "target": target,
-        "name": attr_name
-    }
-    
+
     if attr_name.startswith("_"):
         return make_response(
             cmd.get("req_id"), 
             error={"code": "SecurityViolation", "message": "Access to private attributes is forbidden"},
-            op_info=op_info
+            op_info=_get_attribute_op(cmd)
         )
-    if is_forbidden_name(attr_name):
+    if attr_name in FORBIDDEN_CALLS:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "SecurityViolation", "message": f"Forbidden attribute access: {attr_name}"},
-            op_info=op_info
+            op_info=_get_attribute_op(cmd)
         )
 
     try:
-        obj = resolve_target(target, session_id)
+        obj = resolve_target(target, session)
+    except _ForbiddenTarget as e:
+        return make_response(
+            cmd.get("req_id"), 
+            error={"code": "SecurityViolation", "message": str(e)},
+            op_info=_get_attribute_op(cmd)
+        )
     except ValueError as e:
         if "StaleHandle" in str(e):
             return make_response(
                 cmd.get("req_id"), 
                 error={"code": "StaleHandle", "message": str(e)},
-                op_info=op_info
+                op_info=_get_attribute_op(cmd)
             )
         return make_response(
             cmd.get("req_id"), 
             error={"code": "ProtocolError", "message": str(e)},
-            op_info=op_info
+            op_info=_get_attribute_op(cmd)
         )
 
     try:
         result = getattr(obj, attr_name)
-        return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
+        return make_response(cmd.get("req_id"), value=_encode_result(result, session_id, cmd))
     except Exception as e:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)},
-            op_info=op_info
+            op_info=_get_attribute_op(cmd)
         )
 
-def handle_get_item(cmd):
+def handle_get_item(session, cmd):
     session_id = cmd["session_id"]
     target = cmd["target"]
     key_raw = cmd["key"]  # TnkValue形式を保持
     key = decode_value(key_raw, session_id)
-    
-    # オペレーション情報を先に構築（宣言的）
-    op_info = {
-        "cmd": "get_item",
-        "target": target,
-        "key": key_raw  # 元のTnkValue形式を保持
-    }
-    
+
     try:
-        obj = resolve_target(target, session_id)
+        obj = resolve_target(target, session)
+    except _ForbiddenTarget as e:
+        return make_response(
+            cmd.get("req_id"), 
+            error={"code": "SecurityViolation", "message": str(e)},
+            op_info=_get_item_op(cmd)
+        )
     except ValueError as e:
         if "StaleHandle" in str(e):
             return make_response(
                 cmd.get("req_id"), 
                 error={"code": "StaleHandle", "message": str(e)},
-                op_info=op_info
+                op_info=_get_item_op(cmd)
             )
         return make_response(
             cmd.get("req_id"), 
             error={"code": "ProtocolError", "message": str(e)},
-            op_info=op_info
+            op_info=_get_item_op(cmd)
         )
 
     try:
         result = obj[key]
-        return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
+        return make_response(cmd.get("req_id"), value=_encode_result(result, session_id, cmd))
     except Exception as e:
-        return make_response(
-            cmd.get("req_id"), 
-            error={
-                "code": "PythonException", 
-                "py_type": type(e).__name__, 
-                "message": str(e),
-                "traceback": traceback.format_exc()
-            },
-            op_info=op_info
-        )
+        return _exc_response(cmd.get("req_id"), e, cmd.get("want_traceback", _WANT_TRACEBACK), _get_item_op(cmd))
+
+def _slice_arg(arg, session_id):
+    """スライス引数 (value / handle) を取り出す。handle は __index__ を持つ値のみ"""
+    kind = arg["kind"]
+    if kind == "value":
+        return arg["value"]
+    if kind == "handle":
+        val = decode_value(arg, session_id)
+        try:
+            # operator.index は C レベルの __index__ (numpy の整数型も通る)
+            return operator.index(val)
+        except TypeError:
+            raise TypeError(f"Slice argument handle must resolve to int, got {type(val)}") from None
+    raise ValueError(f"Invalid slice arg kind: {kind}")
 
-def handle_slice(cmd):
+def handle_slice(session, cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
     start_raw = cmd["start"]
     stop_raw = cmd["stop"]
     step_raw = cmd["step"]
-    
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "slice",
-        "target": target_id,
-        "start": start_raw,
-        "stop": stop_raw,
-        "step": step_raw
-    }
-    
-    def decode_slice_arg(arg):
-        if arg["kind"] == "value":
-            return arg["value"]
-        elif arg["kind"] == "handle":
-            val = decode_value(arg, session_id)
-            try:
-                # Be a bit more permissive, try supporting types that execute as index
-                # But spec says strictly check/convert
-                return int(val) 
-            except:
-                 raise TypeError(f"Slice argument handle must resolve to int, got {type(val)}")
-        else:
-            raise ValueError(f"Invalid slice arg kind: {arg['kind']}")
 
     try:
-        start = decode_slice_arg(start_raw)
-        stop = decode_slice_arg(stop_raw)
-        step = decode_slice_arg(step_raw)
+        start = _slice_arg(start_raw, session_id)
+        stop = _slice_arg(stop_raw, session_id)
+        step = _slice_arg(step_raw, session_id)
         
         if step == 0:
             return make_response(
                 cmd.get("req_id"), 
                 error={"code": "PythonException", "py_type": "ValueError", "message": "slice step cannot be zero"},
-                op_info=op_info
+                op_info=_slice_op(cmd)
             )
 
     except Exception as e:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "TypeMismatch", "message": str(e)},
-            op_info=op_info
+            op_info=_slice_op(cmd)
         )
 
-    session = get_session(session_id)
-    if target_id not in session["objects"]:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "StaleHandle", "message": f"Handle {target_id} not found"},
-            op_info=op_info
-        )
+    obj = session["objects"].get(target_id, _MISSING)
+    if obj is _MISSING:
+        return _stale_response(cmd.get("req_id"), target_id, _slice_op(cmd))
     
-    obj = session["objects"][target_id]
     try:
         sl = slice(start, stop, step)
         result = obj[sl]
-        return make_response(cmd.get("req_id"), value=encode_value(result, session_id))
+        return make_response(cmd.get("req_id"), value=_encode_result(result, session_id, cmd))
     except Exception as e:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)},
-            op_info=op_info
+            op_info=_slice_op(cmd)
         )
 
-def handle_iter(cmd):
+class _ArrayCursor:
+    """1 次元 ndarray 用のイテレータ
+
+    next() は通常のイテレータと同じく1要素ずつ返す。iter_next_batch(format=columnar) では
+    take でスライスを1回切り出し、tolist (C レベル) で Python のプリミティブにまとめて変換する
+    (要素ごとに numpy スカラーを作ってエンコードするループを通らない)。
+    """
+    __slots__ = ("_arr", "_pos")
+
+    def __init__(self, arr):
+        self._arr = arr
+        self._pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        pos = self._pos
+        if pos >= len(self._arr):
+            raise StopIteration
+        self._pos = pos + 1
+        return self._arr[pos]
+
+    def __length_hint__(self):
+        return max(len(self._arr) - self._pos, 0)
+
+    def take(self, n):
+        pos = self._pos
+        chunk = self._arr[pos:pos + n]
+        self._pos = pos + len(chunk)
+        return chunk
+
+def handle_iter(session, cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
+
+    obj = session["objects"].get(target_id, _MISSING)
+    if obj is _MISSING:
+        return _stale_response(cmd.get("req_id"), target_id, _iter_op(cmd))
     
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "iter",
-        "target": target_id
-    }
-    
-    session = get_session(session_id)
-    if target_id not in session["objects"]:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "StaleHandle", "message": f"Handle {target_id} not found"},
-            op_info=op_info
-        )
-    
-    obj = session["objects"][target_id]
     try:
-        it = iter(obj)
-        it_id = f"it_{uuid.uuid4().hex[:16]}"
+        numpy = sys.modules.get("numpy")
+        if numpy is not None and type(obj) is numpy.ndarray and obj.ndim == 1:
+            it = _ArrayCursor(obj)
+        else:
+            it = iter(obj)
+        it_id = _make_id("it")
         session["objects"][it_id] = it
         
+        # 他のハンドルと同じく want_repr=false なら repr/str を計算しない (長い repr は切り詰める)
+        type_name = type(it).__name__
+        if cmd.get("want_repr", True):
+            repr_str, str_str = _describe(it, type_name)
+        else:
+            repr_str = str_str = f"<{type_name}>"
         return make_response(cmd.get("req_id"), value={
             "kind": "handle",
             "id": it_id,
-            "type": type(it).__name__,
-            "repr": repr(it),
-            "str": str(it),
+            "type": type_name,
+            "repr": repr_str,
+            "str": str_str,
             "session_id": session_id
         })
     except Exception as e:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)},
-            op_info=op_info
+            op_info=_iter_op(cmd)
         )
 
-def handle_iter_next_batch(cmd):
+def handle_iter_next_batch(session, cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
     batch_size = cmd.get("batch_size", 1000)
+
+    it = session["objects"].get(target_id, _MISSING)
+    if it is _MISSING:
+        return _stale_response(cmd.get("req_id"), target_id, _iter_next_batch_op(cmd))
     
-    # オペレーション情報を先に構築
-    op_info = {
-        "cmd": "iter_next_batch",
-        "target": target_id,
-        "batch_size": batch_size
-    }
-    
-    session = get_session(session_id)
-    if target_id not in session["objects"]:
-        return make_response(
-            cmd.get("req_id"), 
-            error={"code": "StaleHandle", "message": f"Handle {target_id} not found"},
-            op_info=op_info
-        )
-    
-    it = session["objects"][target_id]
-    items = []
-    done = False
+    describe = cmd.get("want_repr", True)
+    # max_bytes を指定したクライアントにだけ、batch_size 未満で done=false のバッチを返しうる
+    max_bytes = cmd.get("max_bytes", 0)
     try:
-        for _ in range(batch_size):
-            item = next(it)
-            items.append(encode_value(item, session_id))
-    except StopIteration:
-        done = True
+        fmt = cmd.get("format")
+        if fmt == "packed" and type(it) is _ArrayCursor:
+            # 1 次元 ndarray はスライスをそのまま {"kind": "ndarray"} のバッファで返す (要素の箱詰めなし)
+            chunk = it.take(batch_size)
+            count = len(chunk)
+            done = count < batch_size
+            value = encode_buffer(chunk)
+        elif fmt == "columnar" or fmt == "packed":
+            # islice で C レベルにまとめて進める。要求数に満たなければ終端に達している
+            if type(it) is _ArrayCursor:
+                raw = it.take(batch_size).tolist()
+            else:
+                raw = list(itertools.islice(it, batch_size))
+            done = len(raw) < batch_size
+            # format=columnar/packed を指定したクライアントには、同じ型のプリミティブを素の配列で返す
+            # (packed なら int/float は JSON 行でも数値バッファにする)
+            value = _encode_columnar(raw, fmt == "packed")
+            if value is None:
+                value = {"kind": "list", "items": _encode_items(raw, session_id, describe)}
+            count = len(raw)
+        else:
+            items, done = _next_batch_items(it, batch_size, max_bytes, session_id, describe)
+            value = {"kind": "list", "items": items}
+            count = len(items)
     except Exception as e:
         return make_response(
             cmd.get("req_id"), 
             error={"code": "PythonException", "py_type": type(e).__name__, "message": str(e)},
-            op_info=op_info
+            op_info=_iter_next_batch_op(cmd)
         )
     
-    return make_response(cmd.get("req_id"), value={"kind": "list", "items": items}, meta={"done": done})
+    # count は実際に返した件数 (max_bytes で batch_size より少なくなることがある)
+    return make_response(cmd.get("req_id"), value=value, meta={"done": done, "count": count})
+
+# max_bytes (1回の iter_next_batch 応答の目安サイズ) を指定されたときは、画像や配列の repr など
+# 大きな要素で数 MB の応答がパイプを塞がないよう、先頭の数件から1件あたりの大きさを見積もって件数を絞る
+_BATCH_SAMPLE = 16
+
+def _next_batch_items(it, batch_size, max_bytes, session_id, describe):
+    """(エンコード済み要素, done) を返す。max_bytes が 0 なら batch_size 件まで読む"""
+    first = min(batch_size, _BATCH_SAMPLE) if max_bytes else batch_size
+    raw = list(itertools.islice(it, first))
+    items = _encode_items(raw, session_id, describe)
+    if len(raw) < first:
+        return items, True
+    limit = batch_size
+    if max_bytes and batch_size > first:
+        per_item = len(_dump_json(items)) / len(items)
+        limit = max(first, min(batch_size, int(max_bytes // per_item)))
+    if limit > first:
+        rest = list(itertools.islice(it, limit - first))
+        items += _encode_items(rest, session_id, describe)
+        return items, len(rest) < limit - first
+    return items, False
 
-def handle_delete(cmd):
+# msgpack フレームでは bytes をそのまま送れる。JSON 行では base64 文字列にする
+_BINARY_WIRE = False
+
+_PACK_CODES = {int: "q", float: "d"}
+# これより短いリストはまとめても要素ごとのラップと大差ないので通常のエンコードにする
+_COLUMNAR_MIN_LEN = 64
+
+def _encode_columnar(raw, pack=False):
+    """同一型プリミティブのバッチを {"kind": "primitive_batch"} / {"kind": "packed"} にする
+
+    要素ごとの {"kind": "value"} ラップを省く。混在バッチやハンドルを含む場合は None。
+    int/float は msgpack フレームでは常に、pack=True なら JSON 行でも (base64 で) packed にする。
+    """
+    types_seen = {type(x) for x in raw}
+    if len(types_seen) != 1:
+        return None
+    tp = types_seen.pop()
+    if tp not in _SCALAR_TYPES:
+        return None
+    code = _PACK_CODES.get(tp)
+    if code is not None and (_BINARY_WIRE or pack):
+        try:
+            data = array.array(code, raw).tobytes()
+        except OverflowError:
+            pass  # 64bit に収まらない int は通常の配列で返す
+        else:
+            if _BINARY_WIRE:
+                return {"kind": "packed", "dtype": code, "data": data}
+            return {"kind": "packed", "dtype": code, "encoding": "base64", "data": base64.b64encode(data).decode("ascii")}
+    if tp is float and not _floats_finite(raw):
+        return None  # NaN/±Infinity は要素ごとのエンコードでハンドルにする
+    return {"kind": "primitive_batch", "dtype": tp.__name__, "items": raw}
+
+def encode_buffer(obj):
+    """配列/バッファを {"kind": "ndarray", dtype, shape, data} に一括変換する
+
+    要素ごとの encode_value を通さず、連続領域を1回でコピーする。
+    """
+    if hasattr(obj, "__array_interface__"):
+        import numpy
+        arr = numpy.ascontiguousarray(obj)
+        dtype, shape, data = arr.dtype.str, list(arr.shape), arr.tobytes()
+    else:
+        mv = memoryview(obj)
+        dtype, shape, data = mv.format, list(mv.shape), mv.tobytes()
+    if not _BINARY_WIRE:
+        return {"kind": "ndarray", "dtype": dtype, "shape": shape, "encoding": "base64",
+                "data": base64.b64encode(data).decode("ascii")}
+    return {"kind": "ndarray", "dtype": dtype, "shape": shape, "data": data}
+
+def encode_shm_buffer(obj):
+    """配列/バッファを新しい共有メモリに1回だけコピーし、{"kind": "shm_buffer"} で名前を返す
+
+    応答には名前・dtype・shape だけが載るので、JSON 行でも base64 化やパイプ経由のコピーが起きない。
+    セグメントの所有権はホストに渡す: ワーカーは写像を閉じるだけなので、読み終えたらホストが unlink する。
+    """
+    if hasattr(obj, "__array_interface__"):
+        import numpy
+        arr = numpy.ascontiguousarray(obj)
+        dtype, shape = arr.dtype.str, list(arr.shape)
+        src = memoryview(arr.reshape(-1)).cast("B")
+    else:
+        mv = memoryview(obj)
+        dtype, shape = mv.format, list(mv.shape)
+        src = mv.cast("B") if mv.c_contiguous else memoryview(mv.tobytes())
+    nbytes = src.nbytes
+    # サイズ 0 のセグメントは作れないので最低 1 バイト確保する (nbytes で実サイズを伝える)
+    shm = _create_shm(max(nbytes, 1))
+    try:
+        shm.buf[:nbytes] = src
+    finally:
+        shm.close()
+    return {"kind": "shm_buffer", "name": shm.name, "dtype": dtype, "shape": shape, "nbytes": nbytes}
+
+def _encode_bytes(data):
+    """bytes 類をハンドルにせず {"kind": "bytes"} で返す (JSON 行では base64)"""
+    if _BINARY_WIRE:
+        return {"kind": "bytes", "data": data if type(data) is bytes else bytes(data)}
+    return {"kind": "bytes", "encoding": "base64", "data": base64.b64encode(data).decode("ascii")}
+
+def handle_get_buffer(session, cmd):
+    """ハンドルが指す配列の中身をまとめて返す (iter_next_batch で1要素ずつ読む代わり)
+
+    shm=true を付けると {"kind": "shm_buffer"} で共有メモリの名前を返す (unlink はホストの責任)。
+    """
+    session_id = cmd["session_id"]
+    target_id = cmd["target"]
+
+    obj = session["objects"].get(target_id, _MISSING)
+    if obj is _MISSING:
+        return _stale_response(cmd.get("req_id"), target_id, _get_buffer_op(cmd))
+    try:
+        # shm=true なら中身を応答に載せず、共有メモリ経由で渡す
+        value = encode_shm_buffer(obj) if cmd.get("shm") else encode_buffer(obj)
+    except (TypeError, ValueError) as e:
+        return make_response(
+            cmd.get("req_id"),
+            error={"code": "TypeMismatch", "message": f"Object does not expose a buffer: {e}"},
+            op_info=_get_buffer_op(cmd)
+        )
+    return make_response(cmd.get("req_id"), value=value)
+
+def handle_describe(session, cmd):
+    """want_repr=false で受け取ったハンドルの repr/str を後から取得する"""
+    target_id = cmd["target"]
+    obj = session["objects"].get(target_id, _MISSING)
+    if obj is _MISSING:
+        return _stale_response(cmd.get("req_id"), target_id, {"cmd": "describe", "target": target_id})
+    type_name = type(obj).__name__
+    repr_str, str_str = _describe(obj, type_name)
+    return make_response(cmd.get("req_id"), value=encode_value({"type": type_name, "repr": repr_str, "str": str_str}, cmd["session_id"]))
+
+def handle_delete(session, cmd):
     session_id = cmd["session_id"]
     target_id = cmd["target"]
     
-    session = get_session(session_id)
-    if target_id in session["objects"]:
-        del session["objects"][target_id]
+    obj = session["objects"].get(target_id, _MISSING)
+    if obj is not _MISSING:
+        # 同じハンドルを複数回渡している場合は、最後の delete で解放する
+        obj_index = session["obj_index"]
+        entry = obj_index.get(id(obj))
+        if entry is not None and entry[0] == target_id and entry[1] > 1:
+            obj_index[id(obj)] = (target_id, entry[1] - 1)
+        else:
+            if entry is not None and entry[0] == target_id:
+                del obj_index[id(obj)]
+            del session["objects"][target_id]
     
-    return make_response(cmd.get("req_id"), value={"kind": "value", "value": None})
+    return make_response(cmd.get("req_id"), value=_NONE_VALUE)
+
+def _resolve_batch_ref(ref, responses):
+    """{"kind": "result", "index": k} -> k 番目の応答の value (前方参照のみ)"""
+    k = ref.get("index")
+    if not isinstance(k, int) or not 0 <= k < len(responses):
+        raise ValueError(f"Invalid batch reference: {k}")
+    resp = responses[k]
+    if resp.get("kind") != "ok":
+        raise LookupError(f"Batch call {k} failed")
+    return resp["value"]
+
+def handle_batch(session, cmd):
+    """複数コマンドを1往復で実行する (JSON-RPC の multicall 相当)
+
+    cmd["calls"] の各要素を順に実行し、応答を同じ順で返す。
+    - "input_from": k  -> k 番目の結果 (ハンドル) を target にする
+    - 引数中の {"kind": "result", "index": k} -> k 番目の結果の値に置き換える
+    session_id を省略したサブコマンドは外側の session_id を使う。
+    失敗したサブコマンドはその要素のエラー応答になり、前後の結果 (新しいハンドルを含む) は失われない。
+    """
+    session_id = cmd.get("session_id")
+    calls = cmd.get("calls")
+    if not isinstance(calls, list):
+        return make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": "batch requires a 'calls' list"})
+
+    responses = []
+    for i, sub in enumerate(calls):
+        if not isinstance(sub, dict):
+            responses.append(make_response(i, error={"code": "ProtocolError", "message": "batch call must be an object"}))
+            continue
+        sub = dict(sub)
+        sub.setdefault("session_id", session_id)
+        sub.setdefault("req_id", i)
+        try:
+            if sub.get("cmd") == "batch":
+                raise ValueError("Nested batch is not supported")
+            if "input_from" in sub:
+                value = _resolve_batch_ref({"index": sub.pop("input_from")}, responses)
+                if value.get("kind") != "handle":
+                    raise ValueError("input_from must refer to a handle result")
+                sub["target"] = value["id"]
+            if "args" in sub:
+                if not isinstance(sub["args"], list):
+                    raise ValueError("args must be a list")
+                sub["args"] = [
+                    _resolve_batch_ref(a, responses) if isinstance(a, dict) and a.get("kind") == "result" else a
+                    for a in sub["args"]
+                ]
+        except LookupError as e:
+            responses.append(make_response(sub["req_id"], error={"code": "DependencyFailed", "message": str(e)}))
+            continue
+        except ValueError as e:
+            responses.append(make_response(sub["req_id"], error={"code": "ProtocolError", "message": str(e)}))
+            continue
+        # 例外はこの要素の WorkerCrash にする (バッチ全体を落とすと実行済みの結果が届かない)
+        responses.append(_run_command(sub))
+
+    return make_response(cmd.get("req_id"), value={"kind": "batch", "items": responses})
+
+def handle_session_end(session, cmd):
+    """セッションを破棄し、そのハンドルをまとめて解放する (delete を1件ずつ送らずに済む)
+
+    解放したハンドル数を返す。同じ session_id の後続要求は空のセッションから始まる。
+    """
+    _SESSIONS.pop(cmd.get("session_id"), None)
+    count = len(session["objects"])
+    session["objects"].clear()
+    session["obj_index"].clear()
+    session["modules"].clear()
+    return make_response(cmd.get("req_id"), value={"kind": "value", "value": count})
+
+def handle_reload_modules(session, cmd):
+    """デバッグ用: resolve_callable のキャッシュを破棄する"""
+    _resolve_cached.cache_clear()
+    return make_response(cmd.get("req_id"), value=_NONE_VALUE)
 
 # --- Main Dispatch ---
 
@@ -578,28 +1180,449 @@ DISPATCHER = {
     "iter": handle_iter,
     "iter_next_batch": handle_iter_next_batch,
     "delete": handle_delete,
+    "reload_modules": handle_reload_modules,
+    "batch": handle_batch,
+    "get_buffer": handle_get_buffer,
+    "describe": handle_describe,
+    "session_end": handle_session_end,
 }
 
-def main():
-    # Unbuffered stdin/stdout is handled by parent, but we can flush manually
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
+# コマンドごとの必須フィールド (dispatch が欠落を ProtocolError にするときだけ参照する)
+_COMMAND_FIELDS = {
+    "call_function": frozenset(("session_id", "target", "args")),
+    "call_method": frozenset(("session_id", "target", "method", "args")),
+    "get_attribute": frozenset(("session_id", "target", "name")),
+    "get_item": frozenset(("session_id", "target", "key")),
+    "slice": frozenset(("session_id", "target", "start", "stop", "step")),
+    "iter": frozenset(("session_id", "target")),
+    "iter_next_batch": frozenset(("session_id", "target")),
+    "delete": frozenset(("session_id", "target")),
+    "get_buffer": frozenset(("session_id", "target")),
+    "describe": frozenset(("session_id", "target")),
+}
+
+def dispatch(cmd):
+    cmd_name = cmd.get("cmd")
+    handler = DISPATCHER.get(cmd_name)
+    if handler is None:
+        return make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": f"Unknown command {cmd_name}"})
+    # セッションはここで1回だけ引き、ハンドラに渡す
+    session = get_session(cmd.get("session_id"))
+    try:
+        if _LOCK_SESSIONS and handler is not handle_batch:
+            # シャードは session_id で決まるので通常は競合しない。batch が別セッションの
+            # サブコマンドを実行する場合だけ待つ (batch 自体は持たないので入れ子のロックは無い)
+            with session["lock"]:
+                return handler(session, cmd)
+        return handler(session, cmd)
+    except KeyError as e:
+        # 必須フィールドの欠落は、ハンドラが cmd["..."] で読んだときの KeyError で分かる。
+        # 成功時には何も検査せず (try は例外が出なければ無償)、欠落時だけ WorkerCrash
+        # (traceback 整形付き) ではなく ProtocolError にする
+        field = e.args[0] if len(e.args) == 1 else None
+        if field in _COMMAND_FIELDS.get(cmd_name, ()) and field not in cmd:
+            return make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": f"{cmd_name} requires field '{field}'"})
+        raise
+
+# 複数スレッドで要求を処理するときだけ True (単一スレッドではロックを取らない)
+_LOCK_SESSIONS = False
+
+def _tolist_default(obj):
+    """各コーデックが直接扱えない配列類 (非連続の ndarray など) は tolist() で変換する"""
+    tolist = getattr(obj, "tolist", None)
+    if tolist is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+    return tolist()
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+# 改行も orjson に書かせる (b"\n" の連結でペイロード全体をコピーしない)
+_ORJSON_LINE_OPTIONS = _ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE if orjson is not None else 0
+
+def _dump_json(resp):
+    """レスポンスを JSON (bytes) にする。orjson があれば優先"""
+    if orjson is not None:
         try:
-            cmd = json.loads(line)
-            cmd_name = cmd.get("cmd")
-            if cmd_name in DISPATCHER:
-                resp = DISPATCHER[cmd_name](cmd)
-            else:
-                resp = make_response(cmd.get("req_id"), error={"code": "ProtocolError", "message": f"Unknown command {cmd_name}"})
+            return orjson.dumps(resp, default=_tolist_default, option=_ORJSON_OPTIONS)
+        except (orjson.JSONEncodeError, TypeError):
+            # 64bit を超える int など orjson が扱えない値は標準 json に任せる
+            pass
+    return json.dumps(resp, default=_tolist_default).encode("utf-8")
+
+def _write_line(stream, resp):
+    """NDJSON 1行を stream に書く
+
+    標準 json の経路では本体と改行を別々に書き、改行付きの全体コピーを作らない。
+    (iterencode による逐次書き出しは C エンコーダを使わず遅いので採らない)
+    """
+    if orjson is not None:
+        try:
+            stream.write(orjson.dumps(resp, default=_tolist_default, option=_ORJSON_LINE_OPTIONS))
+            return
+        except (orjson.JSONEncodeError, TypeError):
+            pass
+    stream.write(json.dumps(resp, default=_tolist_default).encode("utf-8"))
+    stream.write(b"\n")
+
+def _run_command(cmd):
+    """1コマンドを実行してレスポンスを返す (例外は WorkerCrash に変換)"""
+    try:
+        return dispatch(cmd)
+    except Exception as e:
+        req_id = cmd.get("req_id") if isinstance(cmd, dict) else None
+        return make_response(req_id, error={"code": "WorkerCrash", "message": str(e), "traceback": traceback.format_exc()})
+
+def _make_runner(write, flush=None):
+    """(run, write, close) を返す
+
+    flush を渡した場合、同期実行では write 後にフラッシュしない (呼び出し側がまとめて行う)。
+    スレッド実行では応答ごとにロック内でフラッシュする。
+
+    既定では受信順に1件ずつ同期実行する (Rust 側ブリッジは要求と応答が1対1で並ぶ前提)。
+    TNK_WORKER_THREADS=N (N>1) なら session_id のハッシュで N 個のシングルスレッド
+    executor に振り分ける。同じセッションの要求は順序どおり、別セッションの要求は
+    並行に走り (GIL を手放す NumPy や I/O が重なる)、応答は完了順に req_id 付きで返る。
+    出力はロックで直列化し、フレームが混ざらないようにする。
+    "serial": true の要求は全 executor が捌き切るのを待ってから単独で実行する
+    (セッションをまたぐ操作や、前の応答が揃ってから走らせたい要求のためのバリア)。
+    """
+    try:
+        n = int(os.environ.get("TNK_WORKER_THREADS") or 1)
+    except ValueError:
+        n = 1
+    if n <= 1:
+        return (lambda cmd: write(_run_command(cmd))), write, (lambda: None)
+
+    global _LOCK_SESSIONS
+    _LOCK_SESSIONS = True
+
+    lock = threading.Lock()
+    def locked_write(resp):
+        with lock:
+            write(resp)
+            if flush is not None:
+                flush()
+
+    shards = [ThreadPoolExecutor(max_workers=1, thread_name_prefix="tnk-shard") for _ in range(n)]
+    def run(cmd):
+        if not isinstance(cmd, dict):
+            shards[0].submit(lambda: locked_write(_run_command(cmd)))
+            return
+        if cmd.get("serial"):
+            # 受信ループはここで止まるので、待っている間に新しい要求は投入されない
+            for done in [shard.submit(lambda: None) for shard in shards]:
+                done.result()
+            locked_write(_run_command(cmd))
+            return
+        shards[hash(cmd.get("session_id")) % n].submit(lambda: locked_write(_run_command(cmd)))
+
+    def close():
+        for shard in shards:
+            shard.shutdown(wait=True)
+
+    return run, locked_write, close
+
+def serve_json_lines():
+    """既定のワイヤ形式: 1行1 JSON (Rust 側ブリッジはこの形式を話す)"""
+    loads = orjson.loads if orjson is not None else json.loads
+    stdout = sys.stdout.buffer
+    run, write, close = _make_runner(lambda resp: _write_line(stdout, resp), stdout.flush)
+    # os.read はその時点で届いている分をまとめて返す。クライアントがパイプライン送信した
+    # 複数行はここで一度に処理し、応答もまとめて1回でフラッシュする
+    fd = sys.stdin.buffer.fileno()
+    pending = b""
+    while True:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            break
+        lines = (pending + chunk if pending else chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if not line:
+                continue
+            # 前後の空白 (\r を含む) は JSON デコーダがそのまま読み飛ばすので、
+            # 1行ごとの strip() コピーはせず、空白だけの行はデコード失敗時に見分ける
+            try:
+                cmd = loads(line)
+            except json.JSONDecodeError:
+                if line.strip():
+                    write(make_response(None, error={"code": "ProtocolError", "message": "Invalid JSON"}))
+                continue
+            run(cmd)
+        stdout.flush()
+    if pending.strip():
+        # 改行なしで終わった最後の1行
+        try:
+            run(loads(pending))
         except json.JSONDecodeError:
-             resp = make_response(None, error={"code": "ProtocolError", "message": "Invalid JSON"})
+            write(make_response(None, error={"code": "ProtocolError", "message": "Invalid JSON"}))
+    close()
+    stdout.flush()
+
+_FRAME_HEADER = struct.Struct("<I")
+
+class _StdioFrames:
+    """<u32 little-endian 長さ><ペイロード> のフレームを stdin/stdout で送受信する"""
+    # フレームごとに読む属性はスロットに置く (インスタンス辞書を引かない)
+    __slots__ = ("_read", "_stdout")
+    max_frame = 0xFFFFFFFF
+
+    def __init__(self):
+        self._read = sys.stdin.buffer.read
+        self._stdout = sys.stdout.buffer
+
+    def recv(self):
+        header = self._read(_FRAME_HEADER.size)
+        if len(header) < _FRAME_HEADER.size:
+            return None
+        (size,) = _FRAME_HEADER.unpack(header)
+        payload = self._read(size)
+        if len(payload) < size:
+            return None
+        return payload
+
+    def send(self, out):
+        # ヘッダと本体は1回の write にまとめる (分割書き込みによる断片化を避ける)
+        self._stdout.write(_FRAME_HEADER.pack(len(out)) + out)
+        self._stdout.flush()
+
+_RING_POS = struct.Struct("<I")
+
+class _ShmRing:
+    """共有メモリ上の単一生産者・単一消費者リングバッファ
+
+    先頭 8 バイトが head (生産者だけが書く) と tail (消費者だけが書く)、以降がデータ領域。
+    レコードは <u32 長さ><本体> で、データ領域の末尾で折り返す。
+    head == tail が空、1 バイト空けて満杯を区別する。
+    """
+    __slots__ = ("_shm", "_buf", "capacity")
+    _DATA = 8
+
+    def __init__(self, shm):
+        self._shm = shm
+        self._buf = shm.buf
+        self.capacity = shm.size - self._DATA
+
+    def _positions(self):
+        return _RING_POS.unpack_from(self._buf, 0)[0], _RING_POS.unpack_from(self._buf, 4)[0]
+
+    def _write(self, pos, data):
+        base, cap, n = self._DATA, self.capacity, len(data)
+        first = min(n, cap - pos)
+        self._buf[base + pos:base + pos + first] = data[:first]
+        if first < n:
+            self._buf[base:base + n - first] = data[first:]
+        return (pos + n) % cap
+
+    def _read(self, pos, n):
+        base, cap = self._DATA, self.capacity
+        first = min(n, cap - pos)
+        data = bytes(self._buf[base + pos:base + pos + first])
+        if first < n:
+            data += bytes(self._buf[base:base + n - first])
+        return data, (pos + n) % cap
+
+    def push(self, data):
+        """空きが足りなければ False (消費者が読むのを待って再試行する)"""
+        head, tail = self._positions()
+        free = self.capacity - (head - tail) % self.capacity - 1
+        if _RING_POS.size + len(data) > free:
+            return False
+        head = self._write(head, _RING_POS.pack(len(data)))
+        head = self._write(head, data)
+        _RING_POS.pack_into(self._buf, 0, head)
+        return True
+
+    def pop(self):
+        head, tail = self._positions()
+        if head == tail:
+            return None
+        header, tail = self._read(tail, _RING_POS.size)
+        data, tail = self._read(tail, _RING_POS.unpack(header)[0])
+        _RING_POS.pack_into(self._buf, 4, tail)
+        return data
+
+def _attach_shm(name):
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: 生成したのはホスト側なので、終了時に resource_tracker が消さないようにする
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _create_shm(size):
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        # Python < 3.13: 所有権はホストに渡すので、ワーカー終了時に resource_tracker が消さないようにする
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+class _ShmFrames:
+    """TNK_TRANSPORT=shm: フレーム本体は共有メモリのリングで受け渡す
+
+    ホストが作った TNK_SHM_IN (要求) / TNK_SHM_OUT (応答) に接続する。
+    stdin/stdout はドアベルとしてだけ使い、1 フレームごとに 1 バイト流す
+    (パイプを通るのは通知だけで、ペイロードのカーネル経由コピーは起きない)。
+    """
+    __slots__ = ("_in", "_out", "_wait", "_stdout", "max_frame")
+
+    def __init__(self, in_name, out_name):
+        self._in = _ShmRing(_attach_shm(in_name))
+        self._out = _ShmRing(_attach_shm(out_name))
+        self._wait = sys.stdin.buffer.read
+        self._stdout = sys.stdout.buffer
+        self.max_frame = self._out.capacity - _RING_POS.size - 1
+
+    def recv(self):
+        while True:
+            payload = self._in.pop()
+            if payload is not None:
+                return payload
+            if not self._wait(1):
+                return None
+
+    def send(self, out):
+        while not self._out.push(out):
+            time.sleep(0.0005)
+        self._stdout.write(b"\x01")
+        self._stdout.flush()
+
+class _SocketFrames(_StdioFrames):
+    """TNK_SOCKET_PATH: ホストが待ち受ける UNIX ドメインソケットに接続してフレームを送受信する
+
+    フレーム形式は stdin/stdout と同じ <u32 little-endian 長さ><ペイロード>。
+    stdout は print やライブラリの出力と混ざらなくなり、ログ専用に使える。
+    """
+    __slots__ = ("_sock",)
+
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._read = self._sock.makefile("rb", buffering=1 << 16).read
+
+    def send(self, out):
+        self._sock.sendall(_FRAME_HEADER.pack(len(out)) + out)
+
+def serve_framed(loads, dumps, bad_frame_errors, frames=None):
+    """長さ付きフレームで送受信する。frames はフレームの運び方 (既定は stdin/stdout)"""
+    if frames is None:
+        frames = _StdioFrames()
+    max_frame = frames.max_frame
+    def write(resp):
+        try:
+            out = dumps(resp)
         except Exception as e:
-             resp = make_response(None, error={"code": "WorkerCrash", "message": str(e), "traceback": traceback.format_exc()})
-        
-        print(json.dumps(resp))
-        sys.stdout.flush()
+            # msgpack で 64bit を超える int など、コーデックが表せない値はその req_id のエラーにする
+            # (ここで例外を出すと受信ループが終わり、スレッド実行では応答が返らないまま待たせる)
+            out = dumps(make_response(resp.get("req_id"), error={"code": "ProtocolError", "message": f"Response could not be serialized: {type(e).__name__}: {e}"}))
+        if len(out) > max_frame:
+            out = dumps(make_response(resp.get("req_id"), error={"code": "ProtocolError", "message": f"Response of {len(out)} bytes exceeds the transport frame limit"}))
+        frames.send(out)
+    run, write, close = _make_runner(write)
+    while True:
+        payload = frames.recv()
+        if payload is None:
+            break
+        try:
+            cmd = loads(payload)
+        except bad_frame_errors:
+            write(make_response(None, error={"code": "ProtocolError", "message": "Invalid frame"}))
+            continue
+        run(cmd)
+    close()
+
+def serve_msgpack(msgpack, frames=None):
+    """TNK_WIRE=msgpack: 長さ付きフレームで msgpack を送受信する (bytes をそのまま送れる)"""
+    global _BINARY_WIRE
+    _BINARY_WIRE = True
+    # packb は呼ぶたびに Packer を作るので1つを使い回す (書き込みは直列なので共有して安全)
+    packer = msgpack.Packer(use_bin_type=True, default=_tolist_default)
+    serve_framed(
+        lambda payload: msgpack.unpackb(payload, raw=False),
+        packer.pack,
+        (msgpack.UnpackException, ValueError),
+        frames,
+    )
+
+def serve_framed_json(frames=None):
+    """TNK_WIRE=framed-json: 長さ付きフレームで JSON を送受信する (改行区切りに依存しない)"""
+    loads = orjson.loads if orjson is not None else json.loads
+    serve_framed(loads, _dump_json, (json.JSONDecodeError,), frames)
+
+def serve_pickle(frames=None):
+    """TNK_WIRE=pickle: 長さ付きフレームで pickle を送受信する (クライアントも Python の場合向け)
+
+    JSON の文字列化を経ず、bytes や配列のバッファも protocol 5 でそのまま運ぶ。
+    pickle は読み込み時に任意のコードを実行できるので、ワーカーを起動したホスト自身とだけ話すこと。
+    """
+    global _BINARY_WIRE
+    _BINARY_WIRE = True
+    serve_framed(
+        pickle.loads,
+        functools.partial(pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL),
+        # 壊れたフレームの失敗の仕方は一定しない (UnpicklingError, EOFError, ImportError, ...)
+        (Exception,),
+        frames,
+    )
+
+def _preload_modules(names):
+    """TNK_PRELOAD=numpy,pandas: 重いモジュールを裏のスレッドで先に import しておく
+
+    最初の RPC が同じモジュールを要求した場合は import ロックで読み込み完了を待つだけなので、
+    起動直後のハンドシェイクと import の I/O が重なる。失敗しても本番の呼び出し時に改めて報告される。
+    """
+    def run():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"[Worker] Preload of {name} failed: {e}", file=sys.stderr)
+    threading.Thread(target=run, name="tnk-preload", daemon=True).start()
+
+_FRAMED_WIRES = ("msgpack", "framed-json", "pickle")
+
+def main():
+    # Unbuffered stdin/stdout is handled by parent, but we can flush manually
+    preload = [name.strip() for name in os.environ.get("TNK_PRELOAD", "").split(",") if name.strip()]
+    if preload:
+        _preload_modules(preload)
+    wire = os.environ.get("TNK_WIRE")
+    frames = None
+    if os.environ.get("TNK_TRANSPORT") == "shm":
+        # 共有メモリはフレーム単位でしか運べないので、JSON lines 指定でも framed-json にする
+        frames = _ShmFrames(os.environ["TNK_SHM_IN"], os.environ["TNK_SHM_OUT"])
+        if wire not in _FRAMED_WIRES:
+            wire = "framed-json"
+    elif os.environ.get("TNK_SOCKET_PATH"):
+        # ソケットもフレーム単位で運ぶので、フレーム形式以外は framed-json にする
+        frames = _SocketFrames(os.environ["TNK_SOCKET_PATH"])
+        if wire not in _FRAMED_WIRES:
+            wire = "framed-json"
+    if wire == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            if frames is not None:
+                print("[Worker] TNK_WIRE=msgpack but msgpack is not installed; using framed JSON", file=sys.stderr)
+                serve_framed_json(frames)
+                return
+            print("[Worker] TNK_WIRE=msgpack but msgpack is not installed; using JSON lines", file=sys.stderr)
+        else:
+            serve_msgpack(msgpack, frames)
+            return
+    elif wire == "framed-json":
+        serve_framed_json(frames)
+        return
+    elif wire == "pickle":
+        serve_pickle(frames)
+        return
+    serve_json_lines()
 
 if __name__ == "__main__":
     main()
@@ -10,14 +10,24 @@ stdin/stdout で NDJSON 通信を行い、任意の Python ライブラリを呼
 """
 
 import sys
+import os
 import json
+import math
+import itertools
 import importlib
 import traceback
 
+try:
+    import orjson  # 任意: 高速な JSON コーデック
+except ImportError:
+    orjson = None
+
 # オブジェクトハンドル管理
 _objects = {}
-_next_id = 0
+# ハンドル ID は 0 から単調増加 (global 書き換えなしで次の値を取る)
+_handle_ids = itertools.count()
 _modules_cache = {}
+_callables_cache = {}
 
 
 def get_callable(target: str):
@@ -26,10 +36,28 @@ def get_callable(target: str):
     例: "math.sqrt" -> math.sqrt
         "numpy.linalg.norm" -> numpy.linalg.norm
     """
+    cached = _callables_cache.get(target)
+    if cached is not None:
+        return cached
+    
     parts = target.split(".")
     if len(parts) < 2:
         raise ValueError(f"Invalid target: {target}")
     
+    # 読み込み済みのモジュールのうち最も長い接頭辞から先に辿る
+    # (xml.etree.ElementTree.X のように、初回は短い接頭辞から import を試し直していた系統も1回で済む)
+    for i in range(len(parts) - 1, 0, -1):
+        obj = _modules_cache.get(".".join(parts[:i]))
+        if obj is None:
+            continue
+        try:
+            for attr in parts[i:]:
+                obj = getattr(obj, attr)
+        except AttributeError:
+            break
+        _callables_cache[target] = obj
+        return obj
+    
     # 最短モジュール名から試行（例: "numpy" を先に試す）
     for i in range(1, len(parts)):
         module_name = ".".join(parts[:i])
@@ -47,6 +75,8 @@ def get_callable(target: str):
         try:
             for attr in attr_path:
                 obj = getattr(obj, attr)
+            # 解決できたターゲットは文字列全体をキーに覚えておく (失敗はキャッシュしない)
+            _callables_cache[target] = obj
             return obj
         except AttributeError:
             continue
@@ -54,10 +84,8 @@ def get_callable(target: str):
     raise ValueError(f"Cannot resolve target: {target}")
 
 def store_object(obj):
-    global _next_id
-    id_str = str(_next_id)
+    id_str = str(next(_handle_ids))
     _objects[id_str] = obj
-    _next_id += 1
     return {"__t_handle": id_str}
 
 def get_object(handle_data):
@@ -67,45 +95,70 @@ def get_object(handle_data):
             return _objects[id_str]
     raise ValueError(f"Invalid handle: {handle_data}")
 
+_PLAIN_TYPES = frozenset((type(None), int, float, bool, str))
+
 def serialize_result(result, force_value=False):
     """結果を JSON 化可能な形式に変換。変換できない場合はハンドルを返す。
     
     force_value=True の場合、ハンドルではなく値を返す（表示目的）。
     """
-    if result is None or isinstance(result, (int, float, bool, str)):
+    # 正確な型で1回の集合参照 (大半の戻り値はここで返る)
+    # NaN/±Infinity は JSON で表せず orjson は null にするので、値ではなくハンドルで返す
+    if type(result) in _PLAIN_TYPES:
+        if type(result) is float and not math.isfinite(result):
+            return store_object(result)
+        return result
+    if isinstance(result, (int, float, bool, str)):
+        if isinstance(result, float) and not math.isfinite(result):
+            return store_object(result)
         return result
     
-    # NumPy 配列の場合はリストに変換（常に）
-    try:
-        import numpy as np
+    # NumPy/Pandas の値はそのモジュールが読み込み済みのときしか来ないので、
+    # 毎回 import を試みず sys.modules から取る (未インストール時の ImportError 探索も避ける)
+    # NumPy 配列は値として返す。orjson があれば write_response が OPT_SERIALIZE_NUMPY で
+    # バッファから直接 JSON にするので、tolist() で要素ごとの Python オブジェクトを作らない
+    np = sys.modules.get("numpy")
+    if np is not None:
         if isinstance(result, np.ndarray):
-            return result.tolist()
+            # NaN/±Infinity を含む float 配列は OPT_SERIALIZE_NUMPY でも null になるのでハンドルにする
+            if result.dtype.kind == "f" and not np.isfinite(result).all():
+                return store_object(result)
+            return result if orjson is not None else result.tolist()
         if isinstance(result, (np.integer, np.floating)):
-            return result.item()
-    except ImportError:
-        pass
+            return serialize_result(result.item())
     
     # Pandas DataFrame/Series の場合
-    try:
-        import pandas as pd
+    pd = sys.modules.get("pandas")
+    if pd is not None:
         if isinstance(result, pd.DataFrame):
             # DataFrame はメソッドチェーンに使うのでハンドルとして保持
             # ただし to_string() 等の結果は文字列として返される
             return store_object(result)
         if isinstance(result, pd.Series):
-            return result.tolist()
-    except ImportError:
-        pass
+            # 欠損値 (NaN) を含む場合は下の JSON 化チェックでハンドルになる
+            result = result.tolist()
     
     # JSON 化を試行
     try:
         # 基本的なコレクションは再帰的にチェックすべきだが、ここでは一気に dumps して確認
-        json.dumps(result)
+        # (allow_nan=False: 中に NaN/±Infinity があれば ValueError でハンドルにする)
+        json.dumps(result, allow_nan=False)
         return result
     except (TypeError, ValueError):
         # JSON 化できない場合はハンドルとして保存
         return store_object(result)
 
+# traceback.format_exc() はフレームを辿って整形するので重い。
+# 既定では付けず、要求の "traceback": true か TNK_TRACEBACK=1 のときだけ付ける
+_WANT_TRACEBACK = os.environ.get("TNK_TRACEBACK") == "1"
+
+def error_response(e: Exception, request: dict) -> dict:
+    """例外をエラー応答にする (except 節の中で呼ぶ)"""
+    response = {"ok": False, "error": f"{type(e).__name__}: {str(e)}"}
+    if request.get("traceback", _WANT_TRACEBACK):
+        response["traceback"] = traceback.format_exc()
+    return response
+
 def handle_call(request: dict) -> dict:
     """call 操作を処理"""
     target = request.get("target")
@@ -125,11 +178,7 @@ def handle_call(request: dict) -> dict:
         return {"ok": True, "result": serialize_result(result)}
     
     except Exception as e:
-        return {
-            "ok": False,
-            "error": f"{type(e).__name__}: {str(e)}",
-            "traceback": traceback.format_exc()
-        }
+        return error_response(e, request)
 
 def handle_method(request: dict) -> dict:
     """method 操作を処理 (ハンドルに対してメソッド呼び出し)"""
@@ -148,46 +197,94 @@ def handle_method(request: dict) -> dict:
         result = method(*processed_args, **kwargs)
         return {"ok": True, "result": serialize_result(result)}
     except Exception as e:
-        return {
-            "ok": False,
-            "error": f"{type(e).__name__}: {str(e)}",
-            "traceback": traceback.format_exc()
-        }
+        return error_response(e, request)
 
 
-def main():
-    """メインループ: stdin から NDJSON を読み、処理して stdout へ返す"""
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        
+def _tolist_default(obj):
+    """orjson が直接扱えない配列 (非連続・未対応 dtype) や標準 json 経路の配列は tolist() で変換する"""
+    tolist = getattr(obj, "tolist", None)
+    if tolist is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return tolist()
+
+_ORJSON_OPTIONS = orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+
+def write_response(response: dict):
+    """応答を NDJSON 1行として stdout のバッファへ書く (フラッシュは main がまとめて行う)"""
+    out = sys.stdout.buffer
+    if orjson is not None:
         try:
-            request = json.loads(line)
-        except json.JSONDecodeError as e:
-            response = {"id": None, "ok": False, "error": f"JSON parse error: {e}"}
-            print(json.dumps(response), flush=True)
-            continue
-        
-        req_id = request.get("id")
-        op = request.get("op", "call")
-        
-        if op == "shutdown":
-            response = {"id": req_id, "ok": True, "result": "shutdown"}
-            print(json.dumps(response), flush=True)
+            out.write(orjson.dumps(response, default=_tolist_default, option=_ORJSON_OPTIONS))
+            return
+        except (orjson.JSONEncodeError, TypeError):
+            # 64bit を超える整数や非文字列キーなどは標準 json に任せる
+            pass
+    out.write(json.dumps(response, default=_tolist_default).encode("utf-8"))
+    out.write(b"\n")
+
+
+def handle_line(line: bytes, loads) -> bool:
+    """NDJSON 1行を処理して応答を書く。shutdown を受けたら False を返す"""
+    try:
+        request = loads(line)
+    except json.JSONDecodeError as e:
+        # 前後の空白は JSON デコーダが読み飛ばすので main では strip() しない。空白だけの行はここで捨てる
+        if not line.strip():
+            return True
+        # orjson.JSONDecodeError は json.JSONDecodeError のサブクラス
+        response = {"id": None, "ok": False, "error": f"JSON parse error: {e}"}
+        write_response(response)
+        return True
+    
+    req_id = request.get("id")
+    op = request.get("op", "call")
+    
+    if op == "shutdown":
+        response = {"id": req_id, "ok": True, "result": "shutdown"}
+        write_response(response)
+        return False
+    elif op == "call":
+        response = handle_call(request)
+        response["id"] = req_id
+    elif op == "method":
+        response = handle_method(request)
+        response["id"] = req_id
+    elif op == "ping":
+        response = {"id": req_id, "ok": True, "result": "pong"}
+    else:
+        response = {"id": req_id, "ok": False, "error": f"Unknown op: {op}"}
+    
+    write_response(response)
+    return True
+
+
+def main():
+    """メインループ: stdin から NDJSON を読み、処理して stdout へ返す
+    
+    os.read はその時点で届いている分をまとめて返すので、パイプライン送信された複数行は
+    1回の読み込みで処理し、応答も1回のフラッシュでまとめて返す。
+    1行ずつ送るクライアントには従来どおり1応答ごとに返る。
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    fd = sys.stdin.buffer.fileno()
+    stdout = sys.stdout.buffer
+    pending = b""
+    running = True
+    while running:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            # 改行なしで終わった最後の1行
+            if pending.strip():
+                handle_line(pending.strip(), loads)
             break
-        elif op == "call":
-            response = handle_call(request)
-            response["id"] = req_id
-        elif op == "method":
-            response = handle_method(request)
-            response["id"] = req_id
-        elif op == "ping":
-            response = {"id": req_id, "ok": True, "result": "pong"}
-        else:
-            response = {"id": req_id, "ok": False, "error": f"Unknown op: {op}"}
-        
-        print(json.dumps(response), flush=True)
+        lines = (pending + chunk if pending else chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line and not handle_line(line, loads):
+                running = False
+                break
+        stdout.flush()
+    stdout.flush()
 
 
 if __name__ == "__main__":
@@ -3,7 +3,9 @@
 use crate::ir::{HoistedVar, IrAugAssignOp, IrBinOp, IrExpr, IrExprKind, IrNode, IrUnaryOp};
 use crate::semantic::{EmitPlan, FuncEmitPlan, Type};
 use crate::utils::naming::to_snake_case;
-use std::collections::HashMap;
+use std::borrow::Cow;
+use std::collections::{HashMap, HashSet};
+use std::fmt::Write as _;
 
 /// Emit Rust code from IR
 pub fn emit(nodes: &[IrNode], plan: &EmitPlan) -> String {
@@ -41,8 +43,8 @@ pub struct RustEmitter {
     external_imports: Vec<(String, String)>,
     /// Whether we are currently emitting inside a function wrapper that already has py_bridge
     is_inside_resident_func: bool,
-    /// Current function's hoisted variables (need Option<T> pattern)
-    current_hoisted_vars: Vec<HoistedVar>,
+    /// Current function's hoisted variables (need Option<T> pattern), as snake_case names
+    current_hoisted_vars: HashSet<String>,
     /// Variables hoisted in current TryBlock that need unwrap() in else body
     try_hoisted_vars: Vec<String>,
     /// V1.5.2: Variables that shadow hoisted variables in current scope (e.g., for loop vars)
@@ -109,7 +111,7 @@ impl RustEmitter {
             // uses_pyo3: false, // Removed as unused
             external_imports: Vec::new(),
             is_inside_resident_func: false,
-            current_hoisted_vars: Vec::new(),
+            current_hoisted_vars: HashSet::new(),
             try_hoisted_vars: Vec::new(),
             shadowed_vars: Vec::new(),
             current_func_returns_result: false,
@@ -418,7 +420,7 @@ impl std::fmt::Display for TnkValue {{
     }
 
     fn emit_node_internal(&mut self, node: &IrNode) -> String {
-        let indent = "    ".repeat(self.indent);
+        let indent = indent_for(self.indent);
         match node {
             IrNode::VarDecl {
                 name,
@@ -429,10 +431,7 @@ impl std::fmt::Display for TnkValue {{
                 let snake_name = to_snake_case(name);
 
                 // Check if this variable is hoisted (already declared as Option<T>)
-                let is_hoisted = self
-                    .current_hoisted_vars
-                    .iter()
-                    .any(|v| to_snake_case(&v.name) == snake_name);
+                let is_hoisted = self.current_hoisted_vars.contains(&snake_name);
 
                 if is_hoisted {
                     // Hoisted variable: emit assignment with Some()
@@ -484,10 +483,7 @@ impl std::fmt::Display for TnkValue {{
                 let snake_name = to_snake_case(target);
 
                 // Check if this target is a hoisted variable (needs Some() wrapper)
-                let is_func_hoisted = self
-                    .current_hoisted_vars
-                    .iter()
-                    .any(|v| to_snake_case(&v.name) == snake_name);
+                let is_func_hoisted = self.current_hoisted_vars.contains(&snake_name);
                 let is_try_hoisted = self.try_hoisted_vars.contains(&snake_name);
 
                 if is_func_hoisted || is_try_hoisted {
@@ -564,10 +560,7 @@ impl std::fmt::Display for TnkValue {{
             IrNode::MultiVarDecl { targets, value } => {
                 for (name, _, _) in targets {
                     let snake_name = to_snake_case(name);
-                    let is_hoisted = self
-                        .current_hoisted_vars
-                        .iter()
-                        .any(|v| to_snake_case(&v.name) == snake_name);
+                    let is_hoisted = self.current_hoisted_vars.contains(&snake_name);
                     if is_hoisted {
                         self.shadowed_vars.push(snake_name);
                     }
@@ -621,12 +614,14 @@ impl std::fmt::Display for TnkValue {{
                     self.current_func_returns_result = func_plan.returns_result;
 
                     // Set current hoisted variables for top-level scope
-                    let old_hoisted =
-                        std::mem::replace(&mut self.current_hoisted_vars, hoisted_vars.clone());
+                    let old_hoisted = std::mem::replace(
+                        &mut self.current_hoisted_vars,
+                        hoisted_names(hoisted_vars),
+                    );
 
                     // Generate Option<T> declarations for hoisted variables
                     let hoisted_decls = if !hoisted_vars.is_empty() {
-                        let inner_indent = "    ".repeat(self.indent);
+                        let inner_indent = indent_for(self.indent);
                         hoisted_vars
                             .iter()
                             .map(|v| {
@@ -692,14 +687,16 @@ impl std::fmt::Display for TnkValue {{
                     };
 
                     // Set current hoisted variables for this function scope
-                    let old_hoisted =
-                        std::mem::replace(&mut self.current_hoisted_vars, hoisted_vars.clone());
+                    let old_hoisted = std::mem::replace(
+                        &mut self.current_hoisted_vars,
+                        hoisted_names(hoisted_vars),
+                    );
 
                     self.indent += 1;
 
                     // Generate Option<T> declarations for hoisted variables
                     let hoisted_decls = if !hoisted_vars.is_empty() {
-                        let inner_indent = "    ".repeat(self.indent);
+                        let inner_indent = indent_for(self.indent);
                         hoisted_vars
                             .iter()
                             .map(|v| {
@@ -724,9 +721,18 @@ impl std::fmt::Display for TnkValue {{
                     self.current_ret_type = Some(ret.clone());
                     let old_takes_self = self.current_func_takes_self;
                     self.current_func_takes_self = false;
+                    // Resident functions are emitted with the flag set so the body can be reused as-is
+                    let old_resident_flag = self.is_inside_resident_func;
+                    if func_plan.needs_resident {
+                        self.is_inside_resident_func = true;
+                    }
+                    let old_try_hoisted_len = self.try_hoisted_vars.len();
 
                     let body_str = self.emit_nodes(body);
                     self.indent -= 1;
+                    self.is_inside_resident_func = old_resident_flag;
+                    // try blocks in the body register names that stay visible to a re-emit
+                    let registered_try_hoisted = self.try_hoisted_vars.len() != old_try_hoisted_len;
 
                     // Restore previous hoisted vars and ret_type
                     self.current_hoisted_vars = old_hoisted;
@@ -756,31 +762,38 @@ impl std::fmt::Display for TnkValue {{
                         ret
                     };
 
-                    // Re-generate body if resident features are needed, to ensure correct args passing
-                    let final_body_str = if func_plan.needs_resident {
-                        // Re-emit with flag set
-                        self.indent += 1;
-                        let backup_flag = self.is_inside_resident_func;
-                        let backup_hoisted =
-                            std::mem::replace(&mut self.current_hoisted_vars, hoisted_vars.clone());
-                        // ONLY set this if we are NOT in the special __top_level__ (fn main)
-                        // Actually, this block is the "else" (non-__top_level__) path, so it's always true.
-                        self.is_inside_resident_func = true;
-
-                        let backup_returns_result = self.current_func_returns_result;
-                        self.current_func_returns_result = func_plan.returns_result;
-                        self.current_ret_type = Some(ret.clone()); // Store ret type for inner Try blocks
-
-                        let s = self.emit_nodes(body);
-
-                        self.is_inside_resident_func = backup_flag;
-                        self.current_hoisted_vars = backup_hoisted;
-                        self.current_func_returns_result = backup_returns_result;
-                        self.indent -= 1;
-                        s
-                    } else {
-                        body_str
-                    };
+                    // Re-generate a resident body only when the first pass could differ from it:
+                    // the re-emit sees the try-hoisted names registered above and the outer takes_self
+                    let final_body_str =
+                        if func_plan.needs_resident && (registered_try_hoisted || old_takes_self) {
+                            // Re-emit with flag set
+                            self.indent += 1;
+                            let backup_flag = self.is_inside_resident_func;
+                            let backup_hoisted = std::mem::replace(
+                                &mut self.current_hoisted_vars,
+                                hoisted_names(hoisted_vars),
+                            );
+                            // ONLY set this if we are NOT in the special __top_level__ (fn main)
+                            // Actually, this block is the "else" (non-__top_level__) path, so it's always true.
+                            self.is_inside_resident_func = true;
+
+                            let backup_returns_result = self.current_func_returns_result;
+                            self.current_func_returns_result = func_plan.returns_result;
+                            // Store ret type for inner Try blocks
+                            let backup_ret_type =
+                                std::mem::replace(&mut self.current_ret_type, Some(ret.clone()));
+
+                            let s = self.emit_nodes(body);
+
+                            self.is_inside_resident_func = backup_flag;
+                            self.current_hoisted_vars = backup_hoisted;
+                            self.current_func_returns_result = backup_returns_result;
+                            self.current_ret_type = backup_ret_type;
+                            self.indent -= 1;
+                            s
+                        } else {
+                            body_str
+                        };
 
                     // Prepend hoisted variable declarations to body
                     let final_body_str = if !hoisted_decls.is_empty() {
@@ -806,7 +819,7 @@ impl std::fmt::Display for TnkValue {{
                     // V1.5.2: Add implicit Ok(()) for may_raise functions that return Unit
                     let final_body_with_ok =
                         if func_plan.returns_result && *effective_ret == Type::Unit {
-                            let inner_indent = "    ".repeat(self.indent + 1);
+                            let inner_indent = indent_for(self.indent + 1);
                             format!("{}\n{}Ok(())", final_body_str, inner_indent)
                         } else {
                             final_body_str
@@ -868,10 +881,7 @@ impl std::fmt::Display for TnkValue {{
                 // If hoisted, use _loop_<name> as loop variable to avoid shadowing
                 let mut var_mapping: Vec<(String, String, bool)> = Vec::new();
                 for lv in &loop_vars {
-                    let is_hoisted = self
-                        .current_hoisted_vars
-                        .iter()
-                        .any(|v| to_snake_case(&v.name) == *lv);
+                    let is_hoisted = self.current_hoisted_vars.contains(lv);
                     let loop_var_name = if is_hoisted {
                         format!("_loop_{}", lv)
                     } else {
@@ -896,7 +906,7 @@ impl std::fmt::Display for TnkValue {{
                 let mut hoisted_init_assignments = Vec::new();
                 for (hoisted_name, loop_var_name, is_hoisted) in &var_mapping {
                     if *is_hoisted {
-                        let inner_indent = "    ".repeat(base_indent + 1);
+                        let inner_indent = indent_for(base_indent + 1);
                         hoisted_init_assignments.push(format!(
                             "{}{} = Some({});",
                             inner_indent, hoisted_name, loop_var_name
@@ -949,10 +959,7 @@ impl std::fmt::Display for TnkValue {{
                 // If hoisted, use _loop_<name> as loop variable to avoid shadowing
                 let mut var_mapping: Vec<(String, String, bool)> = Vec::new();
                 for lv in &loop_vars {
-                    let is_hoisted = self
-                        .current_hoisted_vars
-                        .iter()
-                        .any(|v| to_snake_case(&v.name) == *lv);
+                    let is_hoisted = self.current_hoisted_vars.contains(lv);
                     let loop_var_name = if is_hoisted {
                         format!("_loop_{}", lv)
                     } else {
@@ -977,7 +984,7 @@ impl std::fmt::Display for TnkValue {{
                 let mut hoisted_init_assignments = Vec::new();
                 for (hoisted_name, loop_var_name, is_hoisted) in &var_mapping {
                     if *is_hoisted {
-                        let inner_indent = "    ".repeat(base_indent + 2);
+                        let inner_indent = indent_for(base_indent + 2);
                         hoisted_init_assignments.push(format!(
                             "{}{} = Some({});",
                             inner_indent, hoisted_name, loop_var_name
@@ -1025,22 +1032,20 @@ impl std::fmt::Display for TnkValue {{
                 } else {
                     format!("{}.unwrap()", batch_mapped)
                 };
-                let while_indent = "    ".repeat(base_indent + 1);
+                let while_indent = indent_for(base_indent + 1);
                 let mut block = String::new();
-                block.push_str(&format!("{indent}let __iter_target = {};\n", iter_target));
-                block.push_str(&format!(
-                    "{indent}let __iter_handle = {};\n",
-                    iter_handle_expr
-                ));
-                block.push_str(&format!("{indent}let mut __iter_done = false;\n"));
-                block.push_str(&format!("{indent}while !__iter_done {{\n"));
-                block.push_str(&format!("{while_indent}let __batch = {};\n", batch_expr));
-                block.push_str(&format!(
-                    "{while_indent}for {} in __batch.items {{\n{}\n{while_indent}}}\n",
+                let _ = writeln!(block, "{indent}let __iter_target = {};", iter_target);
+                let _ = writeln!(block, "{indent}let __iter_handle = {};", iter_handle_expr);
+                let _ = writeln!(block, "{indent}let mut __iter_done = false;");
+                let _ = writeln!(block, "{indent}while !__iter_done {{");
+                let _ = writeln!(block, "{while_indent}let __batch = {};", batch_expr);
+                let _ = writeln!(
+                    block,
+                    "{while_indent}for {} in __batch.items {{\n{}\n{while_indent}}}",
                     var_str, final_body
-                ));
-                block.push_str(&format!("{while_indent}__iter_done = __batch.done;\n"));
-                block.push_str(&format!("{indent}}}"));
+                );
+                let _ = writeln!(block, "{while_indent}__iter_done = __batch.done;");
+                let _ = write!(block, "{indent}}}");
                 block
             }
             IrNode::While { cond, body } => {
@@ -1121,17 +1126,18 @@ impl std::fmt::Display for TnkValue {{
                 }
 
                 let mut result = format!("{indent}#[derive(Clone)]\n");
-                result.push_str(&format!("{indent}struct {name} {{\n"));
+                let _ = writeln!(result, "{indent}struct {name} {{");
                 for (field_name, field_type) in fields {
                     let rust_type = field_type.to_rust_string();
-                    result.push_str(&format!(
-                        "{}    {}: {},\n",
+                    let _ = writeln!(
+                        result,
+                        "{}    {}: {},",
                         indent,
                         to_snake_case(field_name),
                         rust_type
-                    ));
+                    );
                 }
-                result.push_str(&format!("{indent}}}"));
+                let _ = write!(result, "{indent}}}");
                 result
             }
             IrNode::TryBlock {
@@ -1197,27 +1203,27 @@ impl std::fmt::Display for TnkValue {{
                         .as_ref()
                         .map(|t: &crate::semantic::Type| t.to_rust_string())
                         .unwrap_or_else(|| "TnkValue".to_string());
-                    result.push_str(&format!(
-                        "{indent}let mut __ret_val: Option<{}> = None;\n",
+                    let _ = writeln!(
+                        result,
+                        "{indent}let mut __ret_val: Option<{}> = None;",
                         ret_ty_str
-                    ));
+                    );
                 }
 
                 // Emit hoisted variable declarations as Option<T>
                 for (name, ty) in &hoisted_vars {
                     let snake_name = to_snake_case(name);
-                    result.push_str(&format!(
-                        "{indent}let mut {}: Option<{}> = None;\n",
+                    let _ = writeln!(
+                        result,
+                        "{indent}let mut {}: Option<{}> = None;",
                         snake_name,
                         ty.to_rust_string()
-                    ));
+                    );
                 }
 
                 // Use std::panic::catch_unwind to catch panics (like division by zero)
                 // and fall back to except_body
-                result.push_str(&format!(
-                    "{indent}let __try_result = std::panic::catch_unwind(std::panic::AssertUnwindSafe(|| -> Result<(), Box<dyn std::error::Error>> {{\n"
-                ));
+                let _ = writeln!(result, "{indent}let __try_result = std::panic::catch_unwind(std::panic::AssertUnwindSafe(|| -> Result<(), Box<dyn std::error::Error>> {{");
                 self.indent += 1;
 
                 // Set hoisted vars for unwrap() in try body (for return statements)
@@ -1242,14 +1248,15 @@ impl std::fmt::Display for TnkValue {{
                             ..
                         } = node
                         {
-                            let inner_indent = "    ".repeat(self.indent);
+                            let inner_indent = indent_for(self.indent);
                             let snake_name = to_snake_case(name);
-                            result.push_str(&format!(
-                                "{}{} = Some({});\n",
+                            let _ = writeln!(
+                                result,
+                                "{}{} = Some({});",
                                 inner_indent,
                                 snake_name,
                                 self.emit_expr(expr)
-                            ));
+                            );
                             continue;
                         }
                     }
@@ -1263,28 +1270,30 @@ impl std::fmt::Display for TnkValue {{
                 self.try_hoisted_vars = old_try_hoisted_vars;
 
                 // End closure with Ok(())
-                result.push_str(&format!("{indent}    Ok(())\n"));
-                result.push_str(&format!("{indent}}}));\n"));
+                let _ = writeln!(result, "{indent}    Ok(())");
+                let _ = writeln!(result, "{indent}}}));");
 
                 // Handle result: match on outer (panic) and inner (exception)
                 // If OK -> Else block
                 // If Err -> Except block
-                result.push_str(&format!("{indent}match __try_result {{\n"));
-                result.push_str(&format!("{indent}    Ok(Ok(_)) => {{\n")); // Success
+                let _ = writeln!(result, "{indent}match __try_result {{");
+                let _ = writeln!(result, "{indent}    Ok(Ok(_)) => {{"); // Success
 
                 // Handle return if occurred inside try
                 if try_has_return {
-                    let inner_indent = "    ".repeat(self.indent + 1);
+                    let inner_indent = indent_for(self.indent + 1);
                     if self.current_func_returns_result {
-                        result.push_str(&format!(
-                            "{}if let Some(val) = __ret_val {{ return Ok(val); }}\n",
+                        let _ = writeln!(
+                            result,
+                            "{}if let Some(val) = __ret_val {{ return Ok(val); }}",
                             inner_indent
-                        ));
+                        );
                     } else {
-                        result.push_str(&format!(
-                            "{}if let Some(val) = __ret_val {{ return val; }}\n",
+                        let _ = writeln!(
+                            result,
+                            "{}if let Some(val) = __ret_val {{ return val; }}",
                             inner_indent
-                        ));
+                        );
                     }
                 }
 
@@ -1302,26 +1311,25 @@ impl std::fmt::Display for TnkValue {{
                     self.try_hoisted_vars = old_try_hoisted;
                     self.indent -= 2;
                 }
-                result.push_str(&format!("{indent}    }}\n"));
+                let _ = writeln!(result, "{indent}    }}");
 
                 // Error handling logic (Exception OR Panic)
                 // We combine both cases to run except_block
-                result.push_str(&format!("{indent}    Ok(Err(__exc)) => {{\n")); // Python Exception
+                let _ = writeln!(result, "{indent}    Ok(Err(__exc)) => {{"); // Python Exception
                 if let Some(var_name) = except_var {
                     self.indent += 2;
                     // Bind exception
                     if self.current_func_returns_result {
-                        result.push_str(&format!(
-                             "{}let {} = TsuchinokoError::new(\"Exception\", &format!(\"{{}}\", __exc), None);\n",
-                             "    ".repeat(self.indent), to_snake_case(var_name)
-                         ));
+                        let _ = writeln!(result, "{}let {} = TsuchinokoError::new(\"Exception\", &format!(\"{{}}\", __exc), None);",
+                             indent_for(self.indent), to_snake_case(var_name));
                     } else {
                         // Fallback string binding
-                        result.push_str(&format!(
-                            "{}let {} = format!(\"{{}}\", __exc);\n",
-                            "    ".repeat(self.indent),
+                        let _ = writeln!(
+                            result,
+                            "{}let {} = format!(\"{{}}\", __exc);",
+                            indent_for(self.indent),
                             to_snake_case(var_name)
-                        ));
+                        );
                     }
                     self.indent -= 2;
                 }
@@ -1345,26 +1353,25 @@ impl std::fmt::Display for TnkValue {{
                     self.in_except_body = old_in_except_body;
                     self.current_except_var = old_except_var;
                 }
-                result.push_str(&format!("{indent}    }}\n"));
+                let _ = writeln!(result, "{indent}    }}");
 
                 // Panic case
-                result.push_str(&format!("{indent}    Err(__panic) => {{\n"));
+                let _ = writeln!(result, "{indent}    Err(__panic) => {{");
                 if let Some(var_name) = except_var {
                     self.indent += 2;
-                    let indent_str = "    ".repeat(self.indent);
+                    let indent_str = indent_for(self.indent);
                     // Bind panic
-                    result.push_str(&format!(
-                         "{}let {}: String = if let Some(s) = __panic.downcast_ref::<&str>() {{ s.to_string() }} else if let Some(s) = __panic.downcast_ref::<String>() {{ s.clone() }} else {{ \"Unknown panic\".to_string() }};\n",
-                         indent_str, to_snake_case(var_name)
-                     ));
+                    let _ = writeln!(result, "{}let {}: String = if let Some(s) = __panic.downcast_ref::<&str>() {{ s.to_string() }} else if let Some(s) = __panic.downcast_ref::<String>() {{ s.clone() }} else {{ \"Unknown panic\".to_string() }};",
+                         indent_str, to_snake_case(var_name));
                     // If TsuchinokoError is needed
                     if self.current_func_returns_result {
-                        result.push_str(&format!(
-                            "{}let {} = TsuchinokoError::new(\"InternalError\", {}, None);\n",
+                        let _ = writeln!(
+                            result,
+                            "{}let {} = TsuchinokoError::new(\"InternalError\", {}, None);",
                             indent_str,
                             to_snake_case(var_name),
                             to_snake_case(var_name)
-                        ));
+                        );
                     }
                     self.indent -= 2;
                 }
@@ -1388,13 +1395,13 @@ impl std::fmt::Display for TnkValue {{
                     self.in_except_body = old_in_except_body;
                     self.current_except_var = old_except_var;
                 }
-                result.push_str(&format!("{indent}    }}\n"));
+                let _ = writeln!(result, "{indent}    }}");
 
-                result.push_str(&format!("{indent}}};\n")); // End match
+                let _ = writeln!(result, "{indent}}};"); // End match
 
                 // V1.5.0: Emit finally block after the match
                 if let Some(finally_nodes) = finally_body {
-                    result.push_str(&format!("{indent}// finally block\n"));
+                    let _ = writeln!(result, "{indent}// finally block");
                     for node in finally_nodes {
                         result.push_str(&self.emit_node(node));
                         result.push('\n');
@@ -1414,17 +1421,15 @@ impl std::fmt::Display for TnkValue {{
                 if let Some(ret_ty) = &self.current_ret_type {
                     if *ret_ty != Type::Unit {
                         if self.current_func_returns_result {
-                            result.push_str(&format!(
-                                "{}return Ok({});\n",
+                            let _ = writeln!(
+                                result,
+                                "{}return Ok({});",
                                 indent,
                                 ret_ty.to_default_value()
-                            ));
+                            );
                         } else {
-                            result.push_str(&format!(
-                                "{}return {};\n",
-                                indent,
-                                ret_ty.to_default_value()
-                            ));
+                            let _ =
+                                writeln!(result, "{}return {};", indent, ret_ty.to_default_value());
                         }
                     }
                 }
@@ -1445,7 +1450,7 @@ impl std::fmt::Display for TnkValue {{
                 }
                 self.indent -= 1;
                 self.current_struct_name = old_struct;
-                result.push_str(&format!("{indent}}}\n"));
+                let _ = writeln!(result, "{indent}}}");
                 result
             }
             IrNode::MethodDecl {
@@ -1459,7 +1464,7 @@ impl std::fmt::Display for TnkValue {{
                 needs_bridge,
             } => {
                 let method_plan = self.method_plan_for(name, *may_raise, *needs_bridge);
-                let inner_indent = "    ".repeat(self.indent);
+                let inner_indent = indent_for(self.indent);
                 let self_param = if !*takes_self {
                     ""
                 } else if *takes_mut_self {
@@ -1525,15 +1530,15 @@ impl std::fmt::Display for TnkValue {{
 
                 // V1.5.2: Add implicit Ok(()) for may_raise methods returning Unit
                 if method_plan.returns_result && *ret == Type::Unit {
-                    let ok_indent = "    ".repeat(self.indent);
-                    result.push_str(&format!("{}Ok(())\n", ok_indent));
+                    let ok_indent = indent_for(self.indent);
+                    let _ = writeln!(result, "{}Ok(())", ok_indent);
                 }
 
                 self.current_func_returns_result = old_returns_result;
                 self.current_ret_type = old_ret_type;
                 self.current_func_takes_self = old_takes_self;
                 self.indent -= 1;
-                result.push_str(&format!("{inner_indent}}}"));
+                let _ = write!(result, "{inner_indent}}}");
                 result
             }
             IrNode::Raise {
@@ -1618,10 +1623,11 @@ impl std::fmt::Display for TnkValue {{
                     // from module import a, b
                     let mut code = String::new();
                     for item in item_list {
-                        code.push_str(&format!(
-                            "py_bridge.import(\"{}.{}\", \"{}\");\n",
+                        let _ = writeln!(
+                            code,
+                            "py_bridge.import(\"{}.{}\", \"{}\");",
                             module, item, item
-                        ));
+                        );
                     }
                     code
                 } else {
@@ -1642,12 +1648,12 @@ impl std::fmt::Display for TnkValue {{
             // V1.6.0: DynamicValue enum definition (for isinstance)
             IrNode::DynamicEnumDef { name, variants } => {
                 let mut result = format!("{indent}#[derive(Clone, Debug)]\n");
-                result.push_str(&format!("{indent}enum {name} {{\n"));
+                let _ = writeln!(result, "{indent}enum {name} {{");
                 for (variant_name, inner_ty) in variants {
                     let rust_type = inner_ty.to_rust_string();
-                    result.push_str(&format!("{indent}    {variant_name}({rust_type}),\n"));
+                    let _ = writeln!(result, "{indent}    {variant_name}({rust_type}),");
                 }
-                result.push_str(&format!("{indent}}}"));
+                let _ = write!(result, "{indent}}}");
                 result
             }
             // V1.6.0: match expression (for isinstance)
@@ -1657,18 +1663,19 @@ impl std::fmt::Display for TnkValue {{
                 for arm in arms {
                     let variant = &arm.variant;
                     let binding = &arm.binding;
-                    result.push_str(&format!(
-                        "{indent}    DynamicValue::{variant}({binding}) => {{\n"
-                    ));
+                    let _ = writeln!(
+                        result,
+                        "{indent}    DynamicValue::{variant}({binding}) => {{"
+                    );
                     self.indent += 2;
                     for stmt in &arm.body {
                         result.push_str(&self.emit_node(stmt));
                         result.push('\n');
                     }
                     self.indent -= 2;
-                    result.push_str(&format!("{indent}    }}\n"));
+                    let _ = writeln!(result, "{indent}    }}");
                 }
-                result.push_str(&format!("{indent}}}"));
+                let _ = write!(result, "{indent}}}");
                 result
             }
         }
@@ -1794,11 +1801,7 @@ impl std::fmt::Display for TnkValue {{
                 // 1. try_hoisted_vars: variables from try block (need clone due to closure)
                 // 2. current_hoisted_vars: variables hoisted at function level (if/for etc.)
                 let is_try_hoisted = !is_shadowed && self.try_hoisted_vars.contains(&var_name);
-                let is_func_hoisted = !is_shadowed
-                    && self
-                        .current_hoisted_vars
-                        .iter()
-                        .any(|v| to_snake_case(&v.name) == var_name);
+                let is_func_hoisted = !is_shadowed && self.current_hoisted_vars.contains(&var_name);
 
                 if is_try_hoisted {
                     // Try block hoisting needs clone due to catch_unwind closure
@@ -2137,16 +2140,14 @@ impl std::fmt::Display for TnkValue {{
                             if !use_json {
                                 // For HashMap, we need owned Strings if the type is String
                                 if matches!(key_type, Type::String)
-                                    && key_str.starts_with('"')
-                                    && !key_str.contains(".to_string()")
+                                    && is_borrowed_str_literal(k, &key_str)
                                 {
-                                    key_str = format!("{key_str}.to_string()");
+                                    key_str.push_str(".to_string()");
                                 }
                                 if matches!(value_type, Type::String)
-                                    && val_str.starts_with('"')
-                                    && !val_str.contains(".to_string()")
+                                    && is_borrowed_str_literal(v, &val_str)
                                 {
-                                    val_str = format!("{val_str}.to_string()");
+                                    val_str.push_str(".to_string()");
                                 }
                                 format!("({key_str}, {val_str})")
                             } else {
@@ -2347,6 +2348,8 @@ impl std::fmt::Display for TnkValue {{
                     _ => format!("{iter_str}.iter().cloned()"),
                 };
 
+                // ソースを直接 map して collect する (中間 Vec なし)。
+                // filter なしの場合、collect が size_hint (= len) で HashMap を事前確保するので再ハッシュは起きない
                 let out = if let Some(cond) = condition {
                     let cond_str = self.emit_expr_internal(cond);
                     format!(
@@ -2462,7 +2465,7 @@ impl std::fmt::Display for TnkValue {{
                     let stmt_str = if is_last {
                         match stmt {
                             IrNode::Expr(e) => {
-                                format!("{}{}", "    ".repeat(self.indent + 1), self.emit_expr(e))
+                                format!("{}{}", indent_for(self.indent + 1), self.emit_expr(e))
                             }
                             _ => self.emit_node(stmt),
                         }
@@ -2725,11 +2728,8 @@ impl std::fmt::Display for TnkValue {{
                     let var_name = to_snake_case(name);
                     let is_shadowed = self.shadowed_vars.contains(&var_name);
                     let is_try_hoisted = !is_shadowed && self.try_hoisted_vars.contains(&var_name);
-                    let is_func_hoisted = !is_shadowed
-                        && self
-                            .current_hoisted_vars
-                            .iter()
-                            .any(|v| to_snake_case(&v.name) == var_name);
+                    let is_func_hoisted =
+                        !is_shadowed && self.current_hoisted_vars.contains(&var_name);
                     if is_try_hoisted || is_func_hoisted {
                         format!("{}.as_ref().unwrap()", var_name)
                     } else {
@@ -2979,11 +2979,8 @@ impl std::fmt::Display for TnkValue {{
                     let var_name = to_snake_case(name);
                     let is_shadowed = self.shadowed_vars.contains(&var_name);
                     let is_try_hoisted = !is_shadowed && self.try_hoisted_vars.contains(&var_name);
-                    let is_func_hoisted = !is_shadowed
-                        && self
-                            .current_hoisted_vars
-                            .iter()
-                            .any(|v| to_snake_case(&v.name) == var_name);
+                    let is_func_hoisted =
+                        !is_shadowed && self.current_hoisted_vars.contains(&var_name);
                     if is_try_hoisted || is_func_hoisted {
                         format!("{}.as_ref().unwrap()", var_name)
                     } else {
@@ -2998,11 +2995,8 @@ impl std::fmt::Display for TnkValue {{
                     let var_name = to_snake_case(name);
                     let is_shadowed = self.shadowed_vars.contains(&var_name);
                     let is_try_hoisted = !is_shadowed && self.try_hoisted_vars.contains(&var_name);
-                    let is_func_hoisted = !is_shadowed
-                        && self
-                            .current_hoisted_vars
-                            .iter()
-                            .any(|v| to_snake_case(&v.name) == var_name);
+                    let is_func_hoisted =
+                        !is_shadowed && self.current_hoisted_vars.contains(&var_name);
                     if is_try_hoisted || is_func_hoisted {
                         format!("{}.as_mut().unwrap()", var_name)
                     } else {
@@ -3018,68 +3012,57 @@ impl std::fmt::Display for TnkValue {{
                 if args.is_empty() {
                     "println!()".to_string()
                 } else {
-                    let format_specs: Vec<&str> = args
-                        .iter()
-                        .map(|(_, ty)| {
-                            if is_display_compatible(ty) {
-                                "{}"
-                            } else {
-                                "{:?}"
-                            }
-                        })
-                        .collect();
-                    let format_string = format_specs.join(" ");
-
-                    let arg_strs: Vec<String> = args
-                        .iter()
-                        .map(|(expr, ty)| {
-                            let expr_str = self.emit_expr_internal(expr);
+                    // One pass: format specs and arguments are written side by side
+                    let mut format_string = String::new();
+                    let mut arg_strs = String::new();
+                    for (i, (expr, ty)) in args.iter().enumerate() {
+                        if i > 0 {
+                            format_string.push(' ');
+                            arg_strs.push_str(", ");
+                        }
+                        format_string.push_str(if is_display_compatible(ty) {
+                            "{}"
+                        } else {
+                            "{:?}"
+                        });
+                        let expr_str = self.emit_expr_internal(expr);
+                        if matches!(expr.kind, IrExprKind::StringLit(_)) {
                             // For string literals, emit directly
-                            if let IrExprKind::StringLit(s) = &expr.kind {
-                                format!("\"{s}\"")
-                            } else if is_any_type(ty) {
-                                // For Type::Any (serde_json::Value), use display_value helper
-                                // to handle Value::String without quotes
-                                if self.plan.needs_resident {
-                                    format!(
-                                        "bridge::display_value(&{})",
-                                        expr_str.trim_start_matches('&')
-                                    )
-                                } else {
-                                    expr_str
-                                }
-                            } else if expr_str.starts_with('&') {
-                                expr_str
-                            } else {
-                                format!("&{expr_str}")
-                            }
-                        })
-                        .collect();
+                            arg_strs.push_str(&expr_str);
+                        } else if is_any_type(ty) && self.plan.needs_resident {
+                            // For Type::Any (serde_json::Value), use display_value helper
+                            // to handle Value::String without quotes
+                            let _ = write!(
+                                arg_strs,
+                                "bridge::display_value(&{})",
+                                expr_str.trim_start_matches('&')
+                            );
+                        } else if is_any_type(ty) || expr_str.starts_with('&') {
+                            arg_strs.push_str(&expr_str);
+                        } else {
+                            arg_strs.push('&');
+                            arg_strs.push_str(&expr_str);
+                        }
+                    }
 
-                    format!("println!(\"{}\", {})", format_string, arg_strs.join(", "))
+                    format!("println!(\"{format_string}\", {arg_strs})")
                 }
             }
             IrExprKind::Sorted { iter, key, reverse } => {
                 let iter_str = self.emit_expr_internal(iter);
                 let key_str = key.as_ref().map(|k| self.emit_expr_internal(k));
-                let sort_line = if let Some(key_expr) = key_str {
-                    format!("v.sort_by_key({key_expr});")
-                } else {
-                    "v.sort();".to_string()
+                // Rust の安定ソート (driftsort) は自然ラン検出 + Powersort のマージ方針を持つため、
+                // 降順は比較関数を反転した1パスで行う。
+                // key 付き降順は CPython と同じ reverse → sort → reverse で安定性を保つ。
+                let sort_line = match (key_str, *reverse) {
+                    (Some(key_expr), false) => format!("v.sort_by_key({key_expr});"),
+                    (Some(key_expr), true) => {
+                        format!("v.reverse(); v.sort_by_key({key_expr}); v.reverse();")
+                    }
+                    (None, false) => "v.sort();".to_string(),
+                    (None, true) => "v.sort_by(|a, b| b.cmp(a));".to_string(),
                 };
-                let reverse_line = if *reverse {
-                    "v.reverse();".to_string()
-                } else {
-                    String::new()
-                };
-                if reverse_line.is_empty() {
-                    format!("{{ let mut v = {}.to_vec(); {} v }}", iter_str, sort_line)
-                } else {
-                    format!(
-                        "{{ let mut v = {}.to_vec(); {} {} v }}",
-                        iter_str, sort_line, reverse_line
-                    )
-                }
+                format!("{{ let mut v = {}.to_vec(); {} v }}", iter_str, sort_line)
             }
             // V1.3.1: StructConstruct - semantic now provides field information
             IrExprKind::StructConstruct { name, fields } => {
@@ -3153,9 +3136,9 @@ impl std::fmt::Display for TnkValue {{
 
                     for (i, (k, v)) in keywords.iter().enumerate() {
                         let val_expr = self.emit_expr(v);
-                        kw_setup_code.push_str(&format!("let kw_val_{} = {}; ", i, val_expr));
-                        kw_inserts
-                            .push_str(&format!("kw.insert({:?}.to_string(), kw_val_{}); ", k, i));
+                        let _ = write!(kw_setup_code, "let kw_val_{} = {}; ", i, val_expr);
+                        let _ =
+                            write!(kw_inserts, "kw.insert({:?}.to_string(), kw_val_{}); ", k, i);
                     }
 
                     let call_code = if use_method_syntax {
@@ -3211,9 +3194,9 @@ impl std::fmt::Display for TnkValue {{
                     let mut kw_inserts = String::new();
                     for (i, (k, v)) in keywords.iter().enumerate() {
                         let val_expr = self.emit_expr(v);
-                        kw_setup_code.push_str(&format!("let kw_val_{} = {}; ", i, val_expr));
-                        kw_inserts
-                            .push_str(&format!("kw.insert({:?}.to_string(), kw_val_{}); ", k, i));
+                        let _ = write!(kw_setup_code, "let kw_val_{} = {}; ", i, val_expr);
+                        let _ =
+                            write!(kw_inserts, "kw.insert({:?}.to_string(), kw_val_{}); ", k, i);
                     }
                     let mapped = format!(
                         "({{ let mut kw = std::collections::HashMap::new(); {}{} {}.call(&[{}], Some(&kw)) }}).map_err(|e| TsuchinokoError::new(\"BridgeError\", &format!(\"{{}}\", e), None))",
@@ -3426,6 +3409,30 @@ impl CodeEmitter for RustEmitter {
 #[cfg(test)]
 mod tests;
 
+/// snake_case names of a function's hoisted variables, for O(1) "is hoisted" checks
+fn hoisted_names(vars: &[HoistedVar]) -> HashSet<String> {
+    vars.iter().map(|v| to_snake_case(&v.name)).collect()
+}
+
+/// Shared indentation buffer: 32 levels of four spaces
+const INDENT_SPACES: &str = "                                                                                                                                ";
+
+/// Indentation for `level`, borrowed from INDENT_SPACES unless nesting is unusually deep
+fn indent_for(level: usize) -> Cow<'static, str> {
+    match INDENT_SPACES.get(..level * 4) {
+        Some(s) => Cow::Borrowed(s),
+        None => Cow::Owned("    ".repeat(level)),
+    }
+}
+
+/// Whether an emitted expression is a `&'static str` literal that needs `.to_string()`
+///
+/// Decided from the IR kind for literals; other expressions fall back to the emitted text.
+fn is_borrowed_str_literal(expr: &IrExpr, emitted: &str) -> bool {
+    matches!(expr.kind, IrExprKind::StringLit(_))
+        || (emitted.starts_with('"') && !emitted.contains(".to_string()"))
+}
+
 fn is_display_compatible(ty: &Type) -> bool {
     match ty {
         Type::Any | Type::String | Type::Int | Type::Float | Type::Bool => true,
@@ -760,6 +760,25 @@ fn test_emit_dict_comp() {
     assert!(result.contains("HashMap"));
 }
 
+#[test]
+fn test_emit_dict_comp_over_tuple_list_collects_directly() {
+    let mut emitter = RustEmitter::new(EmitPlan::default());
+    let expr = expr(IrExprKind::DictComp {
+        key: Box::new(expr(IrExprKind::Var("k".to_string()))),
+        value: Box::new(expr(IrExprKind::BinOp {
+            left: Box::new(expr(IrExprKind::Var("v".to_string()))),
+            op: IrBinOp::Mul,
+            right: Box::new(expr(IrExprKind::IntLit(2))),
+        })),
+        target: "k, v".to_string(),
+        iter: Box::new(expr(IrExprKind::Var("pairs".to_string()))),
+        condition: None,
+    });
+    let result = emitter.emit_expr(&expr);
+    assert!(result.starts_with("pairs.iter().cloned().map(|(k, v)|"));
+    assert!(!result.contains("collect::<Vec"));
+}
+
 // --- Print ---
 #[test]
 fn test_emit_print_empty() {
@@ -2288,6 +2307,19 @@ fn test_emit_method_call_abs() {
     assert!(result.contains(".abs()"));
 }
 
+// --- Sorted ---
+#[test]
+fn test_emit_sorted_reverse_single_pass() {
+    let mut emitter = RustEmitter::new(EmitPlan::default());
+    let result = emitter.emit_expr(&expr(IrExprKind::Sorted {
+        iter: Box::new(expr(IrExprKind::Var("nums".to_string()))),
+        key: None,
+        reverse: true,
+    }));
+    assert!(result.contains("v.sort_by(|a, b| b.cmp(a));"));
+    assert!(!result.contains("v.reverse()"));
+}
+
 // --- MethodCall sort ---
 #[test]
 fn test_emit_method_call_sort() {
@@ -298,9 +298,8 @@ edition = "2021"
     // The transpiled code usually uses tsuchinoko::bridge::protocol::TnkValue etc.
     // We need to support `tsuchinoko::bridge::` path replacement for full compatibility.
     // Replace full path with `bridge::`
+    // (this also covers `use tsuchinoko::bridge::...` lines)
     let fixed_code = fixed_code.replace("tsuchinoko::bridge::", "bridge::");
-    // Just in case (double check)
-    let fixed_code = fixed_code.replace("use tsuchinoko::bridge::", "use bridge::");
 
     let main_rs = format!(
         r#"// Generated by Tsuchinoko - Python to Rust Transpiler
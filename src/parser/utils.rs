@@ -451,6 +451,9 @@ pub fn find_keyword_balanced(s: &str, keyword: &str) -> Option<usize> {
     None
 }
 
+/// Comparison operators to detect: ==, !=, >=, <=, >, < (in order of length - longest first)
+const COMPARISON_OPERATORS: [&str; 6] = ["==", "!=", ">=", "<=", ">", "<"];
+
 /// V1.6.0: Find all comparison operator positions (for chained comparison detection)
 /// Returns Vec of (position, operator string, operator enum variant index)
 pub fn find_all_comparison_operators_balanced(s: &str) -> Vec<(usize, String)> {
@@ -462,9 +465,6 @@ pub fn find_all_comparison_operators_balanced(s: &str) -> Vec<(usize, String)> {
 
     let chars: Vec<char> = s.chars().collect();
 
-    // Operators to detect: ==, !=, >=, <=, >, < (in order of length - longest first)
-    let operators = vec!["==", "!=", ">=", "<=", ">", "<"];
-
     let mut i = 0;
     while i < chars.len() {
         let c = chars[i];
@@ -499,30 +499,29 @@ pub fn find_all_comparison_operators_balanced(s: &str) -> Vec<(usize, String)> {
                 depth_bracket -= 1;
                 i += 1;
             }
-            _ if depth_paren == 0 && depth_bracket == 0 => {
+            '=' | '!' | '<' | '>' if depth_paren == 0 && depth_bracket == 0 => {
                 let mut found = false;
-                for op in &operators {
+                for op in &COMPARISON_OPERATORS {
                     let op_len = op.len();
-                    if i + op_len <= chars.len() {
-                        let slice: String = chars[i..i + op_len].iter().collect();
-                        if &slice == op {
-                            // Avoid matching < inside << and > inside >>
-                            let should_skip = if *op == "<" {
-                                (i + op_len < chars.len() && chars[i + op_len] == '<')
-                                    || (i > 0 && chars[i - 1] == '<')
-                            } else if *op == ">" {
-                                (i + op_len < chars.len() && chars[i + op_len] == '>')
-                                    || (i > 0 && chars[i - 1] == '>')
-                            } else {
-                                false
-                            };
-
-                            if !should_skip {
-                                results.push((i, op.to_string()));
-                                i += op_len;
-                                found = true;
-                                break;
-                            }
+                    if i + op_len <= chars.len()
+                        && op.chars().eq(chars[i..i + op_len].iter().copied())
+                    {
+                        // Avoid matching < inside << and > inside >>
+                        let should_skip = if *op == "<" {
+                            (i + op_len < chars.len() && chars[i + op_len] == '<')
+                                || (i > 0 && chars[i - 1] == '<')
+                        } else if *op == ">" {
+                            (i + op_len < chars.len() && chars[i + op_len] == '>')
+                                || (i > 0 && chars[i - 1] == '>')
+                        } else {
+                            false
+                        };
+
+                        if !should_skip {
+                            results.push((i, op.to_string()));
+                            i += op_len;
+                            found = true;
+                            break;
                         }
                     }
                 }
@@ -16,6 +16,33 @@ pub struct BuiltinInfo {
     pub description: &'static str,
 }
 
+/// 組み込み関数名の一覧 (`get_builtin_info` のアームと一致させる)
+const BUILTIN_NAMES: &[&str] = &[
+    "range",
+    "len",
+    "list",
+    "str",
+    "int",
+    "float",
+    "bool",
+    "tuple",
+    "dict",
+    "max",
+    "min",
+    "sum",
+    "abs",
+    "enumerate",
+    "zip",
+    "sorted",
+    "reversed",
+    "all",
+    "any",
+    "map",
+    "filter",
+    "print",
+    "input",
+];
+
 /// 組み込み関数の情報を取得
 ///
 /// # Arguments
@@ -152,7 +179,7 @@ pub fn get_builtin_info(name: &str) -> Option<BuiltinInfo> {
 /// # Returns
 /// 組み込み関数の場合true
 pub fn is_builtin(name: &str) -> bool {
-    get_builtin_info(name).is_some()
+    BUILTIN_NAMES.contains(&name)
 }
 
 /// 組み込み関数の戻り値型を取得
@@ -168,31 +195,7 @@ pub fn get_builtin_return_type(name: &str) -> Option<Type> {
 
 /// 全組み込み関数のリストを取得
 pub fn list_all_builtins() -> Vec<&'static str> {
-    vec![
-        "range",
-        "len",
-        "list",
-        "str",
-        "int",
-        "float",
-        "bool",
-        "tuple",
-        "dict",
-        "max",
-        "min",
-        "sum",
-        "abs",
-        "enumerate",
-        "zip",
-        "sorted",
-        "reversed",
-        "all",
-        "any",
-        "map",
-        "filter",
-        "print",
-        "input",
-    ]
+    BUILTIN_NAMES.to_vec()
 }
 
 /// メソッドのメタデータ
@@ -415,6 +418,13 @@ mod tests {
         assert!(!builtins.contains(&"not_a_builtin"));
     }
 
+    #[test]
+    fn test_builtin_names_match_info_table() {
+        for name in list_all_builtins() {
+            assert!(get_builtin_info(name).is_some(), "{name}");
+        }
+    }
+
     #[test]
     fn test_get_list_method_info() {
         let info = get_list_method_info("append", &Type::Int).unwrap();
@@ -40,6 +40,7 @@ use crate::ir::{HoistedVar, IrAugAssignOp, IrBinOp, IrExpr, IrExprKind, IrNode,
 use crate::parser::{
     AugAssignOp, BinOp as AstBinOp, Expr, Program, Stmt, TypeHint, UnaryOp as AstUnaryOp,
 };
+use std::borrow::Cow;
 
 /// Analyze a program and convert to IR
 pub fn analyze(program: &Program) -> Result<Vec<IrNode>, TsuchinokoError> {
@@ -47,6 +48,29 @@ pub fn analyze(program: &Program) -> Result<Vec<IrNode>, TsuchinokoError> {
     analyzer.analyze(program)
 }
 
+/// Body of an `if __name__ == "__main__":` guard (no elif/else), or None for any other statement
+fn main_guard_body(stmt: &Stmt) -> Option<&[Stmt]> {
+    match stmt {
+        Stmt::If {
+            condition:
+                Expr::BinOp {
+                    left,
+                    op: AstBinOp::Eq,
+                    right,
+                },
+            then_body,
+            elif_clauses,
+            else_body: None,
+        } if elif_clauses.is_empty()
+            && matches!(left.as_ref(), Expr::Ident(l) if l == "__name__")
+            && matches!(right.as_ref(), Expr::StringLiteral(r) if r == "__main__") =>
+        {
+            Some(then_body.as_slice())
+        }
+        _ => None,
+    }
+}
+
 /// Semantic analyzer
 pub struct SemanticAnalyzer {
     scope: ScopeStack,
@@ -86,7 +110,7 @@ pub struct SemanticAnalyzer {
     /// V1.7.0: Expression ID counter
     expr_id_counter: u32,
     /// V1.7.0: Type Table (ExprId -> Type)
-    type_table: std::collections::HashMap<crate::ir::ExprId, Type>,
+    type_table: lowering::ExprTypeTable,
 }
 
 impl Default for SemanticAnalyzer {
@@ -117,7 +141,7 @@ impl SemanticAnalyzer {
             current_func_needs_bridge: false,
             needs_bridge_funcs: std::collections::HashSet::new(),
             expr_id_counter: 0,
-            type_table: std::collections::HashMap::new(),
+            type_table: lowering::ExprTypeTable::default(),
         }
     }
 
@@ -653,48 +677,34 @@ impl SemanticAnalyzer {
     }
 
     /// Preprocess top-level statements to normalize main function and guard blocks
-    fn preprocess_top_level(&self, stmts: &[Stmt]) -> Vec<Stmt> {
+    ///
+    /// Without a `__main__` guard the statements are returned as-is (borrowed, no clone).
+    fn preprocess_top_level<'a>(&self, stmts: &'a [Stmt]) -> Cow<'a, [Stmt]> {
+        if !stmts.iter().any(|stmt| main_guard_body(stmt).is_some()) {
+            return Cow::Borrowed(stmts);
+        }
         let has_user_main = stmts
             .iter()
             .any(|stmt| matches!(stmt, Stmt::FuncDef { name, .. } if name == "main"));
-        let mut new_stmts = Vec::new();
+        let mut new_stmts = Vec::with_capacity(stmts.len());
         // Pass: Flatten structure
         for stmt in stmts {
-            // Check for if __name__ == "__main__"
-            if let Stmt::If {
-                condition,
-                then_body,
-                elif_clauses,
-                else_body,
-            } = stmt
-            {
-                if elif_clauses.is_empty() && else_body.is_none() {
-                    if let Expr::BinOp { left, op, right } = condition {
-                        if let (Expr::Ident(l), AstBinOp::Eq, Expr::StringLiteral(r)) =
-                            (left.as_ref(), op, right.as_ref())
-                        {
-                            if l == "__name__" && r == "__main__" {
-                                if has_user_main {
-                                    // User defines main: move it to _main_tsuchinoko and call it.
-                                    new_stmts.push(Stmt::Expr(Expr::Call {
-                                        func: Box::new(Expr::Ident("main".to_string())),
-                                        args: vec![],
-                                        kwargs: vec![],
-                                    }));
-                                } else {
-                                    // No user main: inline guard body directly (no wrapper needed).
-                                    new_stmts.extend(then_body.clone());
-                                }
-                                continue;
-                            }
-                        }
-                    }
+            match main_guard_body(stmt) {
+                Some(_) if has_user_main => {
+                    // User defines main: move it to _main_tsuchinoko and call it.
+                    new_stmts.push(Stmt::Expr(Expr::Call {
+                        func: Box::new(Expr::Ident("main".to_string())),
+                        args: vec![],
+                        kwargs: vec![],
+                    }));
                 }
+                // No user main: inline guard body directly (no wrapper needed).
+                Some(body) => new_stmts.extend_from_slice(body),
+                None => new_stmts.push(stmt.clone()),
             }
-            new_stmts.push(stmt.clone());
         }
 
-        new_stmts
+        Cow::Owned(new_stmts)
     }
 
     pub fn analyze(&mut self, program: &Program) -> Result<Vec<IrNode>, TsuchinokoError> {
@@ -813,7 +823,7 @@ impl SemanticAnalyzer {
         let module_aliases = self.module_global_aliases.clone();
         let lowering = crate::semantic::lowering::LoweringPass::new(
             module_aliases,
-            self.type_table.clone(),
+            std::mem::take(&mut self.type_table),
             self.expr_id_counter,
         );
         let lowered_nodes = lowering.apply(other_decls);
@@ -101,9 +101,7 @@ impl ScopeStack {
                     for (name, var_info) in popped.variables {
                         // Only promote if not already defined in parent
                         // (avoid shadowing parent's definition)
-                        if parent.lookup(&name).is_none() {
-                            parent.variables.insert(name, var_info);
-                        }
+                        parent.variables.entry(name).or_insert(var_info);
                     }
                 }
             }
@@ -187,4 +185,18 @@ mod tests {
         assert!(stack.lookup("global_var").is_some());
         assert!(stack.lookup("local_var").is_some()); // Python: still accessible!
     }
+
+    #[test]
+    fn test_scope_pop_keeps_parent_definition() {
+        let mut stack = ScopeStack::new();
+        stack.define("x", Type::Int, false);
+
+        stack.push();
+        stack.define("x", Type::String, true);
+        stack.pop();
+
+        let info = stack.lookup("x").unwrap();
+        assert_eq!(info.ty, Type::Int);
+        assert!(!info.mutable);
+    }
 }
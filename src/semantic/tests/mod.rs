@@ -1474,6 +1474,25 @@ def test():
     assert!(!ir.is_empty());
 }
 
+#[test]
+fn test_analyze_list_index_count_chunked_scan() {
+    let code = r#"
+def test():
+    arr: list[int] = [1, 2, 2, 3]
+    i = arr.index(arr[0] + 1)
+    n = arr.count(arr[0] + 1)
+"#;
+    let rust = crate::transpile(code).unwrap();
+    assert!(rust.contains("chunks(4)"));
+    assert!(rust.contains("(*e == *__v) as i64).sum::<i64>()"));
+    // 探索値は index/count ごとに1回だけ束縛し、比較は常に束縛した __v と行う
+    assert_eq!(rust.matches("let __v = ").count(), 2);
+    assert_eq!(
+        rust.matches("*e == ").count(),
+        rust.matches("*e == *__v").count()
+    );
+}
+
 // --- dict update ---
 #[test]
 fn test_analyze_dict_update() {
@@ -5,33 +5,72 @@ Tsuchinoko Regression Test Runner
 
 examples/simple/  -> -o オプションで単一ファイルトランスパイル＆実行
 examples/import/  -> --project オプションでプロジェクト生成＆ビルド＆実行
+
+各テストは独立した出力先を使うので、スレッドプールで並列に実行する (-j で並列数を指定)。
+simple テストのバイナリは tnk バイナリとソースのハッシュをキーに tmp/regression_cache に保存し、
+どちらも変わっていなければトランスパイルと rustc を省いて実行だけ行う (--no-cache で無効化)。
+import テストのプロジェクトは毎回削除して生成し直すので、プロジェクト内の target はキャッシュにならない。
+代わりに全プロジェクトで tmp/regression_target を CARGO_TARGET_DIR として共有し、依存クレートのビルドを再利用する。
 """
+import argparse
+import concurrent.futures
+import functools
 import glob
+import hashlib
 import subprocess
 import os
 import sys
 import time
 import shutil
 
-def run_simple_test(py_file):
-    """単一ファイルテスト: -o オプションで直接トランスパイル＆実行"""
-    print(f"Testing {py_file}...", end="", flush=True)
-    
+CACHE_DIR = "tmp/regression_cache"
+# import テストのプロジェクトは毎回作り直すが、ビルド成果物はこのディレクトリを共有して依存クレートを再利用する
+IMPORT_TARGET_DIR = os.path.abspath("tmp/regression_target")
+# 共有ターゲットは cargo がロックで直列化するので、import テストの並列数はここまでに抑える
+# (生成・実行と他テストのビルドが重なる分だけ速くなる。増やしてもロック待ちでタイムアウトしやすくなるだけ)
+IMPORT_JOBS = 2
+
+# main() で1回だけビルドした tnk を直接呼ぶ (テストごとに cargo run を起動しない)
+TNK = os.path.abspath(os.path.join(
+    os.environ.get("CARGO_TARGET_DIR", "target"), "debug", "tnk.exe" if os.name == "nt" else "tnk"))
+
+
+def tnk_digest():
+    """ビルド済み tnk バイナリの SHA-256。見つからなければ None (キャッシュを使わない)"""
+    try:
+        with open(TNK, "rb") as f:
+            return hashlib.sha256(f.read()).digest()
+    except OSError:
+        return None
+
+
+def run_simple_test(py_file, idx=0, digest=None):
+    """単一ファイルテスト: -o オプションで直接トランスパイル＆実行
+
+    digest (tnk バイナリのハッシュ) があれば、同じ tnk・同じソースで作ったバイナリを再利用する。
+
+    Returns: (成功したか, 結果メッセージ)
+    """
     abs_py_file = os.path.abspath(py_file)
-    # Output to tmp directory (ignored by git)
+    # Output to tmp directory (ignored by git). idx ごとに別ファイルにして並列実行時の競合を避ける
     os.makedirs("tmp", exist_ok=True)
-    output_rs = "tmp/regression_test.rs"
-    output_bin = "tmp/regression_test"
-    
+    output_rs = f"tmp/regression_test_{idx}.rs"
+    output_bin = f"tmp/regression_test_{idx}"
+
+    cached_bin = None
+    if digest is not None:
+        with open(abs_py_file, "rb") as f:
+            cached_bin = os.path.join(CACHE_DIR, hashlib.sha256(digest + f.read()).hexdigest())
+        if os.path.exists(cached_bin):
+            return run_binary(cached_bin, " (cached)")
+
     # 1. Transpile
-    cmd_transpile = ["cargo", "run", "--quiet", "--bin", "tnk", "--", abs_py_file, "-o", output_rs]
+    cmd_transpile = [TNK, abs_py_file, "-o", output_rs]
     
     try:
-        subprocess.run(cmd_transpile, capture_output=True, text=True, check=True)
+        subprocess.run(cmd_transpile, stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True)
     except subprocess.CalledProcessError as e:
-        print(" ❌ Transpile Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Transpile Failed\n" + e.stderr
 
     # 2. Compile with rustc
     cmd_compile = ["rustc", output_rs, "-o", output_bin]
@@ -39,81 +78,112 @@ def run_simple_test(py_file):
     try:
         subprocess.run(cmd_compile, capture_output=True, text=True, check=True)
     except subprocess.CalledProcessError as e:
-        print(" ❌ Compile Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Compile Failed\n" + e.stderr
+
+    if cached_bin is not None:
+        # 一時ファイルに書いてから rename する (並列実行中に書きかけを読まないように)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_bin = f"{cached_bin}.{idx}.tmp"
+        shutil.copy2(output_bin, tmp_bin)
+        os.replace(tmp_bin, cached_bin)
 
     # 3. Run
+    return run_binary(output_bin)
+
+
+def run_binary(path, note=""):
+    """トランスパイル済みバイナリを実行する
+
+    Returns: (成功したか, 結果メッセージ)
+    """
     try:
         start_time = time.time()
-        subprocess.run([output_bin], capture_output=True, text=True, check=True, timeout=15)
+        subprocess.run([path], capture_output=True, text=True, check=True, timeout=15)
         duration = time.time() - start_time
-        print(f" ✅ OK ({duration:.2f}s)")
-        return True
+        return True, f" ✅ OK ({duration:.2f}s){note}"
     except subprocess.TimeoutExpired:
-        print(" ❌ Timeout")
-        return False
+        return False, " ❌ Timeout"
     except subprocess.CalledProcessError as e:
-        print(" ❌ Execution Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Execution Failed\n" + e.stderr
 
 
-def run_import_test(py_file):
-    """Import系テスト: --project オプションでプロジェクト生成＆ビルド＆実行"""
-    print(f"Testing {py_file}...", end="", flush=True)
-    
+def run_import_test(py_file, idx=0):
+    """Import系テスト: --project オプションでプロジェクト生成＆ビルド＆実行
+
+    Returns: (成功したか, 結果メッセージ)
+    """
     abs_py_file = os.path.abspath(py_file)
-    project_dir = "tmp/tsuchinoko_regression_project"
+    project_dir = f"tmp/tsuchinoko_regression_project_{idx}"
     
     # プロジェクトディレクトリをクリア
     if os.path.exists(project_dir):
         shutil.rmtree(project_dir)
     
     # 1. Generate project
-    cmd_project = ["cargo", "run", "--quiet", "--bin", "tnk", "--", abs_py_file, "--project", project_dir]
+    cmd_project = [TNK, abs_py_file, "--project", project_dir]
     
     try:
-        subprocess.run(cmd_project, capture_output=True, text=True, check=True)
+        subprocess.run(cmd_project, stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True)
     except subprocess.CalledProcessError as e:
-        print(" ❌ Project Generation Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Project Generation Failed\n" + e.stderr
 
     # 2. Build
     cmd_build = ["cargo", "build", "--release"]
+    env = dict(os.environ, CARGO_TARGET_DIR=IMPORT_TARGET_DIR)
     
     try:
-        subprocess.run(cmd_build, capture_output=True, text=True, check=True, cwd=project_dir, timeout=120)
+        subprocess.run(cmd_build, capture_output=True, text=True, check=True, cwd=project_dir, env=env, timeout=120)
     except subprocess.TimeoutExpired:
-        print(" ❌ Build Timeout")
-        return False
+        return False, " ❌ Build Timeout"
     except subprocess.CalledProcessError as e:
-        print(" ❌ Build Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Build Failed\n" + e.stderr
 
     # 3. Run
     # プロジェクト名はディレクトリ名から取得
     project_name = os.path.basename(project_dir).replace("-", "_")
-    binary_path = os.path.join(project_dir, "target", "release", project_name)
+    binary_path = os.path.join(IMPORT_TARGET_DIR, "release", project_name)
     
     try:
         start_time = time.time()
         subprocess.run([binary_path], capture_output=True, text=True, check=True, timeout=30)
         duration = time.time() - start_time
-        print(f" ✅ OK ({duration:.2f}s)")
-        return True
+        return True, f" ✅ OK ({duration:.2f}s)"
     except subprocess.TimeoutExpired:
-        print(" ❌ Execution Timeout")
-        return False
+        return False, " ❌ Execution Timeout"
     except subprocess.CalledProcessError as e:
-        print(" ❌ Execution Failed")
-        print(e.stderr)
-        return False
+        return False, " ❌ Execution Failed\n" + e.stderr
+
+
+def run_suite(title, runner, files, jobs, first_idx):
+    """テスト群を並列実行し、完了順に結果を表示する。失敗したファイルのリストを返す"""
+    print(f"=== {title} ===")
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(runner, f, first_idx + i): f
+            for i, f in enumerate(files)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            f = futures[future]
+            try:
+                ok, message = future.result()
+            except Exception as e:
+                ok, message = False, f" ❌ Runner Error\n{e}"
+            print(f"Testing {f}...{message}", flush=True)
+            if not ok:
+                failures.append(f)
+    return sorted(failures)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Tsuchinoko regression test runner")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="並列実行数 (デフォルト: CPU コア数)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="simple テストのバイナリキャッシュを使わない")
+    args = parser.parse_args()
+    jobs = max(1, args.jobs)
+
     # tmp ディレクトリを作成 (git ignore対象)
     os.makedirs("tmp", exist_ok=True)
     
@@ -121,32 +191,28 @@ def main():
     simple_files = sorted(glob.glob("examples/simple/*.py"))
     import_files = sorted(glob.glob("examples/import/*.py"))
     
-    success_count = 0
-    fail_count = 0
-    failures = []
-    
     total_tests = len(simple_files) + len(import_files)
-    print(f"Running regression tests: {len(simple_files)} simple + {len(import_files)} import = {total_tests} total")
+    print(f"Running regression tests: {len(simple_files)} simple + {len(import_files)} import = {total_tests} total ({jobs} jobs)")
     print()
+
+    # トランスパイラは先に1回だけビルドし、各テストはそのバイナリ (TNK) を直接起動する
+    build = subprocess.run(["cargo", "build", "--quiet", "--bin", "tnk"], capture_output=True, text=True)
+    if build.returncode != 0:
+        print("❌ Failed to build tnk")
+        print(build.stderr)
+        sys.exit(1)
     
     # Simple tests
-    print("=== Simple Tests ===")
-    for f in simple_files:
-        if run_simple_test(f):
-            success_count += 1
-        else:
-            fail_count += 1
-            failures.append(f)
+    digest = None if args.no_cache else tnk_digest()
+    simple_runner = functools.partial(run_simple_test, digest=digest)
+    failures = run_suite("Simple Tests", simple_runner, simple_files, jobs, 0)
     
     # Import tests
     print()
-    print("=== Import Tests (--project) ===")
-    for f in import_files:
-        if run_import_test(f):
-            success_count += 1
-        else:
-            fail_count += 1
-            failures.append(f)
+    failures += run_suite("Import Tests (--project)", run_import_test, import_files, min(jobs, IMPORT_JOBS), len(simple_files))
+
+    fail_count = len(failures)
+    success_count = total_tests - fail_count
             
     print("-" * 40)
     print(f"Total: {total_tests}, Success: {success_count}, Fail: {fail_count}")
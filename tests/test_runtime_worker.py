@@ -0,0 +1,310 @@
+import sys
+import os
+import json
+import base64
+import struct
+import subprocess
+
+# ランタイムワーカー (src/bridge/python/worker.py) をサブプロセスで起動し、JSON lines で話す
+WORKER = os.path.join(os.path.dirname(__file__), "..", "src", "bridge", "python", "worker.py")
+
+def start_worker(env):
+    proc_env = dict(os.environ)
+    proc_env.update(env)
+    return subprocess.Popen(
+        [sys.executable, WORKER], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, env=proc_env,
+    )
+
+def run_worker(cmds, env=None):
+    """cmds を1行ずつ送り、応答を届いた順に返す"""
+    proc_env = dict(os.environ)
+    proc_env.update(env or {})
+    stdin = "".join(json.dumps(cmd) + "\n" for cmd in cmds)
+    out = subprocess.run(
+        [sys.executable, WORKER], input=stdin.encode("utf-8"),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=proc_env, timeout=60, check=True,
+    ).stdout
+    return [json.loads(line) for line in out.splitlines() if line.strip()]
+
+def value(v):
+    return {"kind": "value", "value": v}
+
+def call(req_id, target, *args, session_id="s"):
+    return {"cmd": "call_function", "session_id": session_id, "req_id": req_id, "target": target, "args": list(args)}
+
+def ref(index):
+    return {"kind": "result", "index": index}
+
+def batch(req_id, *calls, session_id="s"):
+    return {"cmd": "batch", "session_id": session_id, "req_id": req_id, "calls": list(calls)}
+
+def test_non_finite_floats():
+    # NaN/±Infinity は JSON で表せない (orjson は null にする) ので、値ではなくハンドルで返る
+    res = run_worker([
+        call(1, "builtins.float", value("nan")),
+        call(2, "builtins.float", value("-inf")),
+        call(3, "builtins.float", value("1.5")),
+    ])
+    assert res[0]["value"]["kind"] == "handle" and res[0]["value"]["repr"] == "nan"
+    assert res[1]["value"]["kind"] == "handle" and res[1]["value"]["repr"] == "-inf"
+    assert res[2]["value"] == value(1.5)
+
+    # タプルやバッチ読み出しの中の NaN も、その要素だけハンドルになる
+    res = run_worker([batch(
+        1,
+        {"cmd": "call_function", "target": "builtins.float", "args": [value("nan")]},
+        {"cmd": "call_function", "target": "builtins.divmod", "args": [value(7.0), value(2.0)]},
+        {"cmd": "call_function", "target": "builtins.divmod", "args": [value(1.0), ref(0)]},
+        {"cmd": "call_function", "target": "builtins.reversed", "args": [ref(2)]},
+        {"cmd": "iter_next_batch", "input_from": 3, "format": "columnar"},
+    )])
+    items = res[0]["value"]["items"]
+    assert items[1]["value"] == {"kind": "tuple", "items": [value(3.0), value(1.0)]}
+    assert [v["kind"] for v in items[2]["value"]["items"]] == ["handle", "handle"]
+    assert [v["kind"] for v in items[4]["value"]["items"]] == ["handle", "handle"]
+    assert items[4]["meta"]["done"]
+
+def test_batch_item_errors():
+    # 壊れたサブコマンドはその要素だけエラーになり、前後の結果は残る
+    res = run_worker([batch(
+        1,
+        {"cmd": "call_function", "target": "builtins.object", "args": []},
+        5,
+        {"cmd": "call_function", "target": "builtins.len", "args": 5},
+        {"cmd": "call_function", "target": "builtins.len", "args": [{"kind": "bogus"}]},
+        {"cmd": "call_function", "target": "builtins.abs", "args": [value(-2)]},
+        {"cmd": "call_method", "input_from": 0, "method": "__repr__", "args": []},
+    )])
+    assert res[0]["kind"] == "ok"
+    items = res[0]["value"]["items"]
+    assert items[0]["value"]["kind"] == "handle"
+    assert items[1]["error"]["code"] == "ProtocolError" and items[1]["req_id"] == 1
+    assert items[2]["error"]["code"] == "ProtocolError"
+    assert items[3]["kind"] == "error" and items[3]["req_id"] == 3
+    assert items[4]["value"] == value(2)
+    # 0 番目で作ったハンドルは後続から使える
+    assert items[5]["value"]["value"].startswith("<object object")
+
+def test_handle_dedup_and_delete():
+    # 同じオブジェクトを2回返すと同じハンドル ID になり、delete は渡した回数だけ要る
+    res = run_worker([batch(
+        1,
+        {"cmd": "call_function", "target": "builtins.type", "args": [value(1)]},
+        {"cmd": "call_function", "target": "builtins.type", "args": [value(2)]},
+        {"cmd": "delete", "input_from": 0},
+        {"cmd": "describe", "input_from": 1},
+        {"cmd": "delete", "input_from": 1},
+        {"cmd": "describe", "input_from": 1},
+    )])
+    items = res[0]["value"]["items"]
+    assert items[0]["value"]["id"] == items[1]["value"]["id"]
+    assert items[2]["kind"] == "ok"
+    # 1回目の delete の後もオブジェクトは残っている
+    assert items[3]["kind"] == "ok"
+    assert items[4]["kind"] == "ok"
+    # 2回目の delete で解放される
+    assert items[5]["error"]["code"] == "StaleHandle"
+
+def test_get_buffer_and_describe():
+    # get_buffer は配列の中身をまとめて返し、describe は want_repr=false で省いた repr/str を返す
+    res = run_worker([batch(
+        1,
+        {"cmd": "call_function", "target": "array.array", "args": [value("d"), {"kind": "list", "items": [value(1.5), value(2.0)]}], "want_repr": False},
+        {"cmd": "get_buffer", "input_from": 0},
+        {"cmd": "describe", "input_from": 0},
+        {"cmd": "call_function", "target": "builtins.object", "args": []},
+        {"cmd": "get_buffer", "input_from": 3},
+    )])
+    items = res[0]["value"]["items"]
+    assert items[0]["value"]["repr"] == "<array>"
+    buf = items[1]["value"]
+    assert buf["kind"] == "ndarray" and buf["dtype"] == "d" and buf["shape"] == [2]
+    assert base64.b64decode(buf["data"]) == struct.pack("<2d", 1.5, 2.0)
+    desc = {e["key"]["value"]: e["value"]["value"] for e in items[2]["value"]["items"]}
+    assert desc == {"type": "array", "repr": "array('d', [1.5, 2.0])", "str": "array('d', [1.5, 2.0])"}
+    # バッファを持たないオブジェクトは TypeMismatch
+    assert items[4]["error"]["code"] == "TypeMismatch"
+
+def test_shm_transport():
+    # TNK_TRANSPORT=shm: フレームは共有メモリのリング、stdin/stdout は1フレーム1バイトのドアベル
+    from multiprocessing import shared_memory
+    sys.path.insert(0, os.path.dirname(WORKER))
+    from worker import _ShmRing
+    # 応答側のリングは小さくして、折り返しと満杯待ちを通す
+    shm_in = shared_memory.SharedMemory(create=True, size=4096)
+    shm_out = shared_memory.SharedMemory(create=True, size=168)
+    ring_in, ring_out = _ShmRing(shm_in), _ShmRing(shm_out)
+    proc = start_worker({"TNK_TRANSPORT": "shm", "TNK_SHM_IN": shm_in.name, "TNK_SHM_OUT": shm_out.name})
+    try:
+        def send(cmd):
+            assert ring_in.push(cmd if type(cmd) is bytes else json.dumps(cmd).encode("utf-8"))
+            proc.stdin.write(b"\x01")
+            proc.stdin.flush()
+        def recv():
+            assert proc.stdout.read(1) == b"\x01"
+            return json.loads(ring_out.pop())
+
+        # 1応答 ~60 バイトなので数回ごとにリングの末尾で折り返す
+        for i in range(10):
+            send(call(i, "math.sqrt", value(i * i)))
+            assert recv() == {"kind": "ok", "req_id": i, "value": value(float(i))}
+
+        # 2件目の応答はリングが空くまで待たされ、1件目を読むと届く
+        send(call(10, "builtins.abs", value(-1)))
+        send(call(11, "builtins.str", value("y" * 60)))
+        assert recv()["value"] == value(1)
+        assert recv()["value"] == value("y" * 60)
+
+        # リングに収まらない応答はフレーム上限の ProtocolError になる
+        send(call(12, "builtins.str", value("x" * 200)))
+        res = recv()
+        assert res["req_id"] == 12 and res["error"]["code"] == "ProtocolError"
+        send(b"{bad")
+        assert recv()["error"]["code"] == "ProtocolError"
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=10)
+        for shm in (shm_in, shm_out):
+            shm.close()
+            shm.unlink()
+    assert proc.returncode == 0
+
+def send_frame(write, payload):
+    write(struct.pack("<I", len(payload)) + payload)
+
+def recv_frame(read):
+    (size,) = struct.unpack("<I", read(4))
+    return read(size)
+
+def test_socket_transport():
+    # TNK_SOCKET_PATH: ホストが待ち受けるソケットでフレームをやり取りし、stdout はログ専用になる
+    import socket
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "worker.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        server.settimeout(30)
+        proc = start_worker({"TNK_SOCKET_PATH": path})
+        conn, _ = server.accept()
+        with conn, conn.makefile("rb") as reader:
+            read = reader.read
+            send_frame(conn.sendall, json.dumps(call(1, "builtins.print", value("to stdout"))).encode("utf-8"))
+            assert json.loads(recv_frame(read)) == {"kind": "ok", "req_id": 1, "value": value(None)}
+            send_frame(conn.sendall, json.dumps(call(2, "math.sqrt", value(16))).encode("utf-8"))
+            assert json.loads(recv_frame(read))["value"] == value(4.0)
+            send_frame(conn.sendall, b"{bad")
+            assert json.loads(recv_frame(read))["error"]["code"] == "ProtocolError"
+        server.close()
+        out, _ = proc.communicate(timeout=10)
+    assert proc.returncode == 0
+    # print の出力はフレームに混ざらず stdout に出る
+    assert out == b"to stdout\n"
+
+def test_pickle_wire():
+    # TNK_WIRE=pickle: stdin/stdout の長さ付きフレームで pickle を送受信する
+    import math
+    import pickle
+    proc = start_worker({"TNK_WIRE": "pickle"})
+    try:
+        def roundtrip(cmd):
+            send_frame(proc.stdin.write, cmd if type(cmd) is bytes else pickle.dumps(cmd))
+            proc.stdin.flush()
+            return pickle.loads(recv_frame(proc.stdout.read))
+        assert roundtrip(call(1, "math.sqrt", value(9)))["value"] == value(3.0)
+        # NaN はそのまま運べるので値で返る
+        res = roundtrip(call(2, "builtins.float", value("nan")))
+        assert res["value"]["kind"] == "value" and math.isnan(res["value"]["value"])
+        # bytes は base64 を経ずにそのまま届く
+        cmd = call(3, "builtins.bytes", value(3))
+        cmd["inline_arrays"] = "binary"
+        assert roundtrip(cmd)["value"] == {"kind": "bytes", "data": b"\x00\x00\x00"}
+        assert roundtrip(b"not a pickle")["error"]["code"] == "ProtocolError"
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=10)
+    assert proc.returncode == 0
+
+def test_threaded_runner():
+    # TNK_WORKER_THREADS=N: 別セッションは並行、同じセッションは順序どおり、serial は全件の後
+    # (シャードは session_id のハッシュで決まるので、a と b が別シャードになるシードに固定する)
+    res = run_worker([
+        call("slow", "time.sleep", value(0.5), session_id="a"),
+        call("after-slow", "math.sqrt", value(4), session_id="a"),
+        call("fast", "math.sqrt", value(9), session_id="b"),
+        dict(call("serial", "builtins.abs", value(-1), session_id="b"), serial=True),
+    ], env={"TNK_WORKER_THREADS": "4", "PYTHONHASHSEED": "0"})
+    order = [r["req_id"] for r in res]
+    assert order == ["fast", "slow", "after-slow", "serial"], order
+    assert res[0]["value"] == value(3.0) and res[3]["value"] == value(1)
+
+    # 既定 (1スレッド) では受信順に返る
+    res = run_worker([
+        call("slow", "time.sleep", value(0.1), session_id="a"),
+        call("fast", "math.sqrt", value(9), session_id="b"),
+    ])
+    assert [r["req_id"] for r in res] == ["slow", "fast"]
+
+def test_iter_next_batch_max_bytes():
+    # 既定では batch_size 件ずつ返す。max_bytes を指定したときだけ件数が絞られ、done=false のまま短くなる
+    res = run_worker([batch(
+        1,
+        {"cmd": "call_function", "target": "builtins.iter", "args": [{"kind": "list", "items": [value("x" * 1000)] * 100}]},
+        {"cmd": "iter_next_batch", "input_from": 0, "batch_size": 40},
+        {"cmd": "iter_next_batch", "input_from": 0, "batch_size": 40, "max_bytes": 4096},
+        {"cmd": "iter_next_batch", "input_from": 0, "batch_size": 100},
+    )])
+    items = res[0]["value"]["items"]
+    assert items[1]["meta"] == {"done": False, "count": 40}
+    assert len(items[1]["value"]["items"]) == 40
+    short = items[2]["meta"]
+    assert short["done"] is False and 0 < short["count"] < 40
+    assert len(items[2]["value"]["items"]) == short["count"]
+    # 残りは全部読めて終端に達する
+    assert items[3]["meta"] == {"done": True, "count": 60 - short["count"]}
+
+def test_framed_serialize_error():
+    # コーデックが表せない応答 (msgpack の 64bit を超える int など) はその req_id のエラーになり、
+    # ワーカーは次の要求を処理し続ける
+    sys.path.insert(0, os.path.dirname(WORKER))
+    import worker
+
+    class ListFrames:
+        max_frame = 1 << 20
+        def __init__(self, payloads):
+            self.payloads = list(payloads)
+            self.sent = []
+        def recv(self):
+            return self.payloads.pop(0) if self.payloads else None
+        def send(self, out):
+            self.sent.append(json.loads(out))
+
+    def dumps(resp):
+        # msgpack と同じく 64bit に収まらない int を拒否する
+        v = resp.get("value")
+        if type(v) is dict and type(v.get("value")) is int and v["value"] >= 1 << 64:
+            raise OverflowError("int too big to convert")
+        return json.dumps(resp).encode("utf-8")
+
+    frames = ListFrames(json.dumps(cmd).encode("utf-8") for cmd in [
+        call(1, "math.factorial", value(30)),
+        call(2, "math.factorial", value(5)),
+    ])
+    worker.serve_framed(json.loads, dumps, (json.JSONDecodeError,), frames)
+    assert frames.sent[0]["req_id"] == 1 and frames.sent[0]["error"]["code"] == "ProtocolError"
+    assert frames.sent[1] == {"kind": "ok", "req_id": 2, "value": value(120)}
+
+if __name__ == "__main__":
+    test_non_finite_floats()
+    test_batch_item_errors()
+    test_handle_dedup_and_delete()
+    test_get_buffer_and_describe()
+    test_iter_next_batch_max_bytes()
+    test_shm_transport()
+    test_socket_transport()
+    test_pickle_wire()
+    test_threaded_runner()
+    test_framed_serialize_error()
+    print("Runtime Worker Tests Passed!")
@@ -35,5 +35,16 @@ def test_handle_management():
     assert worker.get_object(res_ns) is ns
     print("Worker Handle Test Passed!")
 
+def test_non_finite_floats():
+    # NaN/±Infinity は JSON で表せない (orjson は null にする) のでハンドルで返す
+    for v in (float("nan"), float("inf"), [1.0, float("-inf")], {"x": float("nan")}):
+        res = worker.serialize_result(v)
+        assert isinstance(res, dict) and "__t_handle" in res
+        assert worker.get_object(res) is v
+    assert worker.serialize_result(1.5) == 1.5
+    assert worker.serialize_result([1.0, 2.0]) == [1.0, 2.0]
+    print("Worker Non-Finite Float Test Passed!")
+
 if __name__ == "__main__":
     test_handle_management()
+    test_non_finite_floats()